@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Offline bulk OCR for DeepSeek-OCR (vLLM-based)
+Streams receipts from a directory or manifest straight into the engine in large
+batches and appends results to a JSONL file, without the HTTP/base64 overhead of
+/ocr/batch. Uses the same image loading, prompt and SamplingParams as the server.
+
+Usage:
+    python3 deepseek_ocr_bulk.py receipts/ -o results.jsonl
+    python3 deepseek_ocr_bulk.py manifest.jsonl -o results.jsonl --batch-size 128
+
+    # Shard across GPUs: one process per GPU
+    CUDA_VISIBLE_DEVICES=0 python3 deepseek_ocr_bulk.py receipts/ -o results.jsonl --num-shards 2 --shard-index 0
+    CUDA_VISIBLE_DEVICES=1 python3 deepseek_ocr_bulk.py receipts/ -o results.jsonl --num-shards 2 --shard-index 1
+
+Manifests are either text files with one path or URL per line, or JSONL files with
+{"id": "...", "image": "path, URL or base64"} per line. Runs are resumable: ids of
+successful records are appended to a checkpoint file and skipped on the next run.
+Failed records (images that could not be loaded) are written to the results file but
+not checkpointed, so re-running the same command retries them; when an id appears
+more than once in the results file, the last record is the current one.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.heic', '.bmp', '.tif', '.tiff'}
+
+
+def read_items(source):
+    """
+    List the receipts to process
+
+    Args:
+        source: Directory of images, text manifest or JSONL manifest
+
+    Returns:
+        List of (id, image reference) tuples in a stable order
+    """
+    path = Path(source)
+    if path.is_dir():
+        return [
+            (str(p.relative_to(path)), str(p))
+            for p in sorted(path.rglob('*'))
+            if p.suffix.lower() in IMAGE_EXTENSIONS
+        ]
+
+    items = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('{'):
+                entry = json.loads(line)
+                items.append((str(entry.get('id', entry['image'])), entry['image']))
+            else:
+                items.append((line, line))
+    return items
+
+
+def in_shard(item_id, shard_index, num_shards):
+    """Stable assignment of an item to a shard, independent of listing order"""
+    digest = hashlib.sha1(item_id.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % num_shards == shard_index
+
+
+def load_checkpoint(checkpoint_path):
+    """Ids already completed by earlier runs"""
+    if not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path) as f:
+        return {line.rstrip('\n') for line in f if line.strip()}
+
+
+def load_item(server, reference):
+    """Load an image from a local path, URL or base64 string"""
+    from PIL import Image
+
+    if os.path.exists(reference):
+        return Image.open(reference).convert("RGB")
+    return server.load_image(reference)
+
+
+def load_batch(server, batch):
+    """Load a batch of (id, reference) items, returning (id, reference, image or exception)"""
+    loaded = []
+    for item_id, reference in batch:
+        try:
+            loaded.append((item_id, reference, load_item(server, reference)))
+        except Exception as e:
+            loaded.append((item_id, reference, e))
+    return loaded
+
+
+def process_batch(server, loaded, prompt, tiling):
+    """
+    Run one engine batch and build the JSONL records
+
+    Tall receipts are tiled exactly like /ocr; all tiles and tile overlap bands of the
+    batch are submitted in a single llm.generate() call.
+
+    Args:
+        server: The imported deepseek_ocr_server module
+        loaded: Output of load_batch()
+        prompt: Prompt built by build_prompt()
+        tiling: 'auto', True or False
+
+    Returns:
+        List of result dicts in input order
+    """
+    records = []
+    model_inputs = []
+    spans = []
+    for item_id, reference, image in loaded:
+        record = {'id': item_id, 'source': reference if len(reference) < 1024 else None}
+        records.append(record)
+        if isinstance(image, Exception):
+            record.update({'success': False, 'error': f'Failed to load image: {image}'})
+            spans.append(None)
+            continue
+        if server.should_tile(image, tiling):
+            tiles = server.split_into_tiles(image)
+            overlaps = server.split_tile_overlaps(image)
+        else:
+            tiles, overlaps = [image], []
+        spans.append((len(model_inputs), len(tiles), len(overlaps)))
+        model_inputs.extend({"prompt": prompt, "multi_modal_data": {"image": crop}} for crop in tiles + overlaps)
+
+    outputs = server.llm.generate(model_inputs, server.build_sampling_params()) if model_inputs else []
+
+    for record, span in zip(records, spans):
+        if span is None:
+            continue
+        start, count, overlap_count = span
+        texts = [o.outputs[0].text for o in outputs[start:start + count]]
+        try:
+            parsed = [json.loads(text) for text in texts]
+            if count == 1:
+                structured_data = parsed[0]
+            else:
+                overlaps = []
+                for o in outputs[start + count:start + count + overlap_count]:
+                    try:
+                        overlaps.append(json.loads(o.outputs[0].text))
+                    except json.JSONDecodeError:
+                        overlaps.append(None)
+                structured_data = server.merge_tile_results(parsed, overlaps)
+            record.update({'success': True, 'structured_data': structured_data, 'tiles': count})
+        except json.JSONDecodeError:
+            record.update({'success': True, 'text': '\n'.join(texts), 'tiles': count,
+                           'warning': 'JSON parsing failed'})
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='Directory of images or manifest file')
+    parser.add_argument('-o', '--output', required=True, help='JSONL results file (appended to)')
+    parser.add_argument('--checkpoint', help='Completed-ids file (default: <output>.checkpoint)')
+    parser.add_argument('--prompt', default='Free OCR.')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=8, help='Image loading threads')
+    parser.add_argument('--tiling', choices=['auto', 'on', 'off'], default='auto')
+    parser.add_argument('--num-shards', type=int, default=1)
+    parser.add_argument('--shard-index', type=int, default=0)
+    parser.add_argument('--limit', type=int, help='Stop after this many items (for smoke tests)')
+    args = parser.parse_args()
+
+    if not 0 <= args.shard_index < args.num_shards:
+        parser.error('--shard-index must be between 0 and --num-shards - 1')
+
+    output_path = args.output
+    checkpoint_path = args.checkpoint or f"{output_path}.checkpoint"
+    if args.num_shards > 1:
+        # Each shard writes its own files so processes never share a file handle
+        output_path = f"{output_path}.shard{args.shard_index}"
+        checkpoint_path = f"{checkpoint_path}.shard{args.shard_index}"
+
+    items = [item for item in read_items(args.source) if in_shard(item[0], args.shard_index, args.num_shards)]
+    done = load_checkpoint(checkpoint_path)
+    pending = [item for item in items if item[0] not in done]
+    if args.limit is not None:
+        pending = pending[:args.limit]
+
+    already_done = sum(1 for item_id, _ in items if item_id in done)
+    print(f"📂 {len(items)} item(s) in shard {args.shard_index + 1}/{args.num_shards}, "
+          f"{already_done} already done, {len(pending)} to process")
+    if not pending:
+        return
+
+    # Importing the server loads the model (or the engine injected with DEEPSEEK_OCR_ENGINE)
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    import deepseek_ocr_server as server
+
+    if not server.MODEL_LOADED:
+        print("❌ DeepSeek-OCR model not loaded. Check the logs above.")
+        sys.exit(1)
+
+    prompt = server.build_prompt(args.prompt)
+    tiling = {'auto': 'auto', 'on': True, 'off': False}[args.tiling]
+    batches = [pending[i:i + args.batch_size] for i in range(0, len(pending), args.batch_size)]
+
+    processed = 0
+    failed = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor, \
+            open(output_path, 'a') as output_file, \
+            open(checkpoint_path, 'a') as checkpoint_file:
+
+        def submit(batch):
+            # Split loading across the worker threads, keeping the batch order
+            chunk = max(1, len(batch) // args.workers)
+            return [executor.submit(load_batch, server, batch[i:i + chunk]) for i in range(0, len(batch), chunk)]
+
+        # Load the next batch while the engine works on the current one
+        next_loads = submit(batches[0])
+        for index in range(len(batches)):
+            loaded = [entry for future in next_loads for entry in future.result()]
+            if index + 1 < len(batches):
+                next_loads = submit(batches[index + 1])
+
+            records = process_batch(server, loaded, prompt, tiling)
+
+            # Results are flushed before their ids are checkpointed
+            for record in records:
+                output_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            output_file.flush()
+            os.fsync(output_file.fileno())
+            checkpoint_file.write(''.join(f"{record['id']}\n" for record in records if record['success']))
+            checkpoint_file.flush()
+
+            processed += len(records)
+            failed += sum(1 for record in records if not record['success'])
+            elapsed = time.perf_counter() - start
+            print(f"   {processed}/{len(pending)} done, {processed / elapsed:.2f} images/s")
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ Processed {processed} image(s) ({failed} failed) in {elapsed:.1f}s "
+          f"→ {processed / elapsed:.2f} images/s")
+    print(f"📝 Results: {output_path}")
+    if failed:
+        print(f"🔁 {failed} failed image(s) were not checkpointed; re-run the same command to retry them")
+
+
+if __name__ == '__main__':
+    main()
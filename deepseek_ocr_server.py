@@ -6,8 +6,13 @@ Note: Requires GPU with CUDA support for optimal performance
 Based on: https://docs.vllm.ai/projects/recipes/en/latest/DeepSeek/DeepSeek-OCR.html
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, make_response, g, has_request_context
 import base64
+import functools
+import hashlib
+import hmac
+import itertools
+import sys
 from PIL import Image
 import io
 import logging
@@ -15,6 +20,14 @@ import os
 import requests
 from urllib.parse import urlparse
 import json
+import math
+import queue
+import signal
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from datetime import datetime, timezone
 
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -71,39 +84,378 @@ RECEIPT_JSON_SCHEMA = {
     }
 }
 
-# Initialize DeepSeek-OCR with vLLM
-logging.info("🔧 Initializing DeepSeek-OCR model with vLLM...")
+# Tiling configuration for long receipts
+# Receipts taller than TILE_ASPECT_RATIO (height / width) are sliced into overlapping
+# horizontal tiles instead of being downscaled as a single image
+TILE_ASPECT_RATIO = float(os.environ.get('DEEPSEEK_OCR_TILE_ASPECT_RATIO', '3.0'))
+TILE_HEIGHT_RATIO = float(os.environ.get('DEEPSEEK_OCR_TILE_HEIGHT_RATIO', '1.5'))  # Tile height as a multiple of image width
+TILE_OVERLAP_RATIO = float(os.environ.get('DEEPSEEK_OCR_TILE_OVERLAP_RATIO', '0.15'))  # Fraction of tile height shared with the next tile
+TILE_MAX_TILES = int(os.environ.get('DEEPSEEK_OCR_TILE_MAX_TILES', '8'))
 
-try:
-    import os
-    # Disable HF_TRANSFER which causes issues
-    os.environ['HF_HUB_ENABLE_HF_TRANSFER'] = '0'
-    
-    from vllm import LLM, SamplingParams, StructuredOutputsParams
+# CPU pre-screening of uploaded images before they reach the GPU
+# 'reject' answers unusable images with an error code, 'flag' only adds a warning, 'off' disables it
+# Defaults to 'flag': the thresholds are calibrated on synthetic images only, and the iOS
+# client reports any non-200 response as a generic server error
+PRESCREEN_MODE = os.environ.get('DEEPSEEK_OCR_PRESCREEN', 'flag')
+PRESCREEN_MIN_SHARPNESS = float(os.environ.get('DEEPSEEK_OCR_PRESCREEN_MIN_SHARPNESS', '30.0'))  # Laplacian variance
+PRESCREEN_MIN_BRIGHTNESS = float(os.environ.get('DEEPSEEK_OCR_PRESCREEN_MIN_BRIGHTNESS', '40.0'))  # Mean grey level
+PRESCREEN_MAX_CLIPPED = float(os.environ.get('DEEPSEEK_OCR_PRESCREEN_MAX_CLIPPED', '0.6'))  # Fraction of blown-out pixels
+PRESCREEN_MIN_CONTRAST = float(os.environ.get('DEEPSEEK_OCR_PRESCREEN_MIN_CONTRAST', '8.0'))  # Grey level standard deviation
+PRESCREEN_MIN_TEXT_DENSITY = float(os.environ.get('DEEPSEEK_OCR_PRESCREEN_MIN_TEXT_DENSITY', '0.005'))  # Fraction of edge pixels
+PRESCREEN_TESSERACT = os.environ.get('DEEPSEEK_OCR_PRESCREEN_TESSERACT', '0') == '1'
+PRESCREEN_TESSERACT_MAX_SIDE = int(os.environ.get('DEEPSEEK_OCR_PRESCREEN_TESSERACT_MAX_SIDE', '1280'))  # Keeps receipt text legible
+TESSDATA_DIR = os.environ.get('TESSDATA_PREFIX', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tessdata'))
+
+# Resolution cascade: decode a downscaled copy first and re-run at full resolution
+# only when the confidence score is below DEEPSEEK_OCR_CASCADE_THRESHOLD
+CASCADE_ENABLED = os.environ.get('DEEPSEEK_OCR_CASCADE', '0') == '1'
+CASCADE_MAX_SIDE = int(os.environ.get('DEEPSEEK_OCR_CASCADE_MAX_SIDE', '640'))
+CASCADE_THRESHOLD = float(os.environ.get('DEEPSEEK_OCR_CASCADE_THRESHOLD', '0.8'))
+
+# Dynamic batching: concurrent requests are merged into one llm.generate() call
+# The autotuner adjusts the batch size and batching window online to meet the p95 target
+BATCHING_ENABLED = os.environ.get('DEEPSEEK_OCR_BATCHING', '1') == '1'
+BATCH_TARGET_P95_MS = float(os.environ.get('DEEPSEEK_OCR_TARGET_P95_MS', '8000'))
+BATCH_MAX_SIZE = int(os.environ.get('DEEPSEEK_OCR_MAX_BATCH_SIZE', '8'))  # Initial value
+BATCH_MAX_SIZE_LIMIT = int(os.environ.get('DEEPSEEK_OCR_MAX_BATCH_SIZE_LIMIT', '64'))
+BATCH_WINDOW_MS = float(os.environ.get('DEEPSEEK_OCR_BATCH_WINDOW_MS', '10'))  # Initial value
+BATCH_WINDOW_MS_LIMIT = float(os.environ.get('DEEPSEEK_OCR_BATCH_WINDOW_MS_LIMIT', '200'))
+BATCH_AUTOTUNE = os.environ.get('DEEPSEEK_OCR_AUTOTUNE', '1') == '1'
+BATCH_RESULT_TIMEOUT = float(os.environ.get('DEEPSEEK_OCR_GENERATE_TIMEOUT', '600'))  # Seconds a request waits for its batch
+
+# Request capture for offline replay (scripts/replay_deepseek_ocr.py)
+# DEEPSEEK_OCR_CAPTURE is the JSONL log path; uploaded images are stored next to it
+# in <path>.images/ only when DEEPSEEK_OCR_CAPTURE_IMAGES=1
+CAPTURE_PATH = os.environ.get('DEEPSEEK_OCR_CAPTURE', '')
+CAPTURE_IMAGES = os.environ.get('DEEPSEEK_OCR_CAPTURE_IMAGES', '0') == '1'
+
+# Admin endpoints (/admin/...) for profiling; disabled unless a token is configured
+ADMIN_TOKEN = os.environ.get('DEEPSEEK_OCR_ADMIN_TOKEN', '')
+PROFILE_MAX_SECONDS = float(os.environ.get('DEEPSEEK_OCR_PROFILE_MAX_SECONDS', '120'))
+
+# Graceful shutdown: on SIGTERM stop accepting requests and wait this long for in-flight ones
+DRAIN_TIMEOUT = float(os.environ.get('DEEPSEEK_OCR_DRAIN_TIMEOUT', '25'))
+# vLLM pre-allocates this fraction of GPU memory. Hot-reloading a model snapshot loads a
+# second engine next to the serving one, so it is only allowed at or below
+# RELOAD_MAX_GPU_MEMORY_UTILIZATION; set DEEPSEEK_OCR_GPU_MEMORY_UTILIZATION=0.45 to use it
+GPU_MEMORY_UTILIZATION = float(os.environ.get('DEEPSEEK_OCR_GPU_MEMORY_UTILIZATION', '0.9'))
+RELOAD_MAX_GPU_MEMORY_UTILIZATION = 0.5
+DEFAULT_MODEL_PATH = "./model_cache/models--deepseek-ai--DeepSeek-OCR/snapshots/2c968b433af61a059311cbf8997765023806a24d"
+
+# Model snapshot validation and page-cache prefetch at startup
+MODEL_PATH = os.environ.get('DEEPSEEK_OCR_MODEL_PATH', '')
+ALLOW_DOWNLOAD = os.environ.get('DEEPSEEK_OCR_ALLOW_DOWNLOAD', '0') == '1'
+WEIGHTS_MANIFEST = os.environ.get('DEEPSEEK_OCR_WEIGHTS_MANIFEST', '')  # Default: <snapshot>/weights_manifest.json
+VERIFY_WEIGHTS = os.environ.get('DEEPSEEK_OCR_VERIFY_WEIGHTS', 'sha256')  # 'sha256', 'size' or 'off'
+PREFETCH_WEIGHTS = os.environ.get('DEEPSEEK_OCR_PREFETCH', '1') == '1'
+PREFETCH_WORKERS = int(os.environ.get('DEEPSEEK_OCR_PREFETCH_WORKERS', '8'))
+PREFETCH_CHUNK_BYTES = 64 * 1024 * 1024
+WEIGHT_SUFFIXES = ('.safetensors', '.bin', '.pt', '.pth')
+
+# Inference engine: 'vllm', or 'module:factory' to inject another engine called as
+# factory(model_path), e.g. scripts/stub_engine.py for benchmarks without a GPU
+ENGINE = os.environ.get('DEEPSEEK_OCR_ENGINE', 'vllm')
+
+
+class SnapshotError(Exception):
+    """The local model snapshot is missing, incomplete or fails checksum verification"""
+
+def resolve_model_path(model_path=None):
+    """
+    Find the model snapshot to load
+
+    An explicitly configured snapshot (argument or DEEPSEEK_OCR_MODEL_PATH) must exist.
+    The default local cache only falls back to downloading from HuggingFace when
+    DEEPSEEK_OCR_ALLOW_DOWNLOAD=1, so a missing volume is reported instead of
+    silently turning into a multi-GB download.
+
+    Args:
+        model_path: Snapshot directory, None for the configured default
+
+    Returns:
+        Local snapshot directory, or the HuggingFace model id when downloading is allowed
+    """
+    explicit = model_path or MODEL_PATH
+    path = explicit or DEFAULT_MODEL_PATH
+    if os.path.isdir(path):
+        return path
+    if explicit:
+        raise SnapshotError(f"Model snapshot not found: {path}")
+    if ALLOW_DOWNLOAD:
+        logging.warning(f"⚠️  No local snapshot at {path}, downloading deepseek-ai/DeepSeek-OCR from HuggingFace")
+        return "deepseek-ai/DeepSeek-OCR"
+    raise SnapshotError(
+        f"Model snapshot not found at {path}. Mount the snapshot and set DEEPSEEK_OCR_MODEL_PATH, "
+        f"or set DEEPSEEK_OCR_ALLOW_DOWNLOAD=1 to download from HuggingFace"
+    )
+
+def weight_files(snapshot):
+    """Weight files in a snapshot, relative to it (HuggingFace snapshot symlinks are followed)"""
+    files = []
+    for root, _, names in os.walk(snapshot, followlinks=True):
+        for name in names:
+            if name.endswith(WEIGHT_SUFFIXES):
+                files.append(os.path.relpath(os.path.join(root, name), snapshot))
+    return sorted(files)
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(PREFETCH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def write_weights_manifest(snapshot):
+    """
+    Record size and SHA-256 of every weight file in <snapshot>/weights_manifest.json
+
+    Args:
+        snapshot: Snapshot directory
+
+    Returns:
+        Path of the written manifest
+    """
+    manifest = {
+        'files': {
+            name: {
+                'size': os.path.getsize(os.path.join(snapshot, name)),
+                'sha256': _sha256_file(os.path.join(snapshot, name))
+            }
+            for name in weight_files(snapshot)
+        }
+    }
+    path = os.path.join(snapshot, 'weights_manifest.json')
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return path
+
+def check_snapshot(snapshot):
+    """
+    Fast structural check of a local snapshot: every manifest file exists with the right size
+
+    Args:
+        snapshot: Snapshot directory
+
+    Returns:
+        Manifest file dict, or None when the snapshot has no manifest
+    """
+    manifest_path = WEIGHTS_MANIFEST or os.path.join(snapshot, 'weights_manifest.json')
+    if not os.path.exists(manifest_path):
+        if not weight_files(snapshot):
+            raise SnapshotError(f"No weight files in snapshot {snapshot}")
+        logging.warning(f"⚠️  No weights manifest at {manifest_path}, checksums will not be verified")
+        return None
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)['files']
+    problems = []
+    for name, expected in manifest.items():
+        path = os.path.join(snapshot, name)
+        if not os.path.exists(path):
+            problems.append(f"{name}: missing")
+        elif os.path.getsize(path) != expected['size']:
+            problems.append(f"{name}: {os.path.getsize(path)} bytes, expected {expected['size']}")
+    if problems:
+        raise SnapshotError(f"Snapshot {snapshot} does not match its manifest: " + '; '.join(problems))
+    return manifest
+
+def _prefetch_range(path, offset, length):
+    """Read a byte range so it lands in the page cache"""
+    with open(path, 'rb', buffering=0) as f:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), offset, length, os.POSIX_FADV_WILLNEED)
+        f.seek(offset)
+        buffer = bytearray(min(length, 4 * 1024 * 1024))
+        remaining = length
+        while remaining > 0:
+            read = f.readinto(memoryview(buffer)[:min(remaining, len(buffer))])
+            if not read:
+                break
+            remaining -= read
+
+def prefetch_weights(snapshot, manifest=None):
+    """
+    Pull weight files into the page cache in parallel and verify their checksums
+
+    Files are split into PREFETCH_CHUNK_BYTES ranges read by DEEPSEEK_OCR_PREFETCH_WORKERS
+    threads, so even a single multi-GB safetensors file is read in parallel. With a
+    manifest and DEEPSEEK_OCR_VERIFY_WEIGHTS=sha256, one hashing thread per file follows
+    behind the prefetchers and mostly reads from the warmed cache.
+
+    Args:
+        snapshot: Snapshot directory
+        manifest: Manifest file dict from check_snapshot(), or None
+
+    Returns:
+        Dict with files, bytes and seconds
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    start = time.perf_counter()
+    files = sorted(manifest) if manifest else weight_files(snapshot)
+    paths = {name: os.path.join(snapshot, name) for name in files}
+    verify = manifest is not None and VERIFY_WEIGHTS == 'sha256'
+    total_bytes = 0
+    with ThreadPoolExecutor(max_workers=PREFETCH_WORKERS) as prefetchers, \
+            ThreadPoolExecutor(max_workers=max(1, len(files))) as hashers:
+        hashes = {name: hashers.submit(_sha256_file, path) for name, path in paths.items()} if verify else {}
+        if PREFETCH_WEIGHTS:
+            ranges = []
+            for path in paths.values():
+                size = os.path.getsize(path)
+                total_bytes += size
+                ranges.extend((path, offset, min(PREFETCH_CHUNK_BYTES, size - offset))
+                              for offset in range(0, size, PREFETCH_CHUNK_BYTES))
+            for future in [prefetchers.submit(_prefetch_range, *r) for r in ranges]:
+                future.result()
+        mismatches = [name for name, future in hashes.items() if future.result() != manifest[name]['sha256']]
+    if mismatches:
+        raise SnapshotError(f"Checksum mismatch in snapshot {snapshot}: {', '.join(mismatches)}")
+    return {'files': len(files), 'bytes': total_bytes, 'seconds': round(time.perf_counter() - start, 2)}
+
+def create_engine(model_path):
+    """
+    Create the inference engine
+
+    Args:
+        model_path: Local snapshot directory or HuggingFace model id
+
+    Returns:
+        vllm.LLM instance, or the engine built by the DEEPSEEK_OCR_ENGINE factory
+    """
+    if ENGINE != 'vllm':
+        import importlib
+        module_name, _, factory = ENGINE.partition(':')
+        return getattr(importlib.import_module(module_name), factory or 'create_engine')(model_path)
+
+    from vllm import LLM
     from vllm.model_executor.models.deepseek_ocr import NGramPerReqLogitsProcessor
-    
-    # Use local model cache if available, otherwise download from HuggingFace
-    model_path = "./model_cache/models--deepseek-ai--DeepSeek-OCR/snapshots/2c968b433af61a059311cbf8997765023806a24d"
-    if not os.path.exists(model_path):
-        model_path = "deepseek-ai/DeepSeek-OCR"
-    
+
     # Create model instance using vLLM (official configuration)
     # Flash Attention is automatically enabled by vLLM for supported GPUs
-    llm = LLM(
+    return LLM(
         model=model_path,
         enable_prefix_caching=False,  # Not needed for OCR tasks
         mm_processor_cache_gb=0,  # Save memory
         logits_processors=[NGramPerReqLogitsProcessor],  # Important for markdown table generation
+        gpu_memory_utilization=GPU_MEMORY_UTILIZATION,
+        disable_log_stats=False,  # Engine metrics (KV-cache preemptions) feed the batch autotuner
     )
-    
+
+def prepare_snapshot(model_path=None):
+    """
+    Resolve and structurally check the snapshot; fast enough to run before the HTTP server starts
+
+    Returns:
+        Tuple of (model path, manifest or None)
+    """
+    if ENGINE != 'vllm' and not (model_path or MODEL_PATH):
+        return None, None
+    path = resolve_model_path(model_path)
+    manifest = check_snapshot(path) if os.path.isdir(path) and VERIFY_WEIGHTS != 'off' else None
+    return path, manifest
+
+def load_engine(model_path, manifest, timings):
+    """
+    Prefetch and verify weights while the engine is being constructed
+
+    vLLM spends its first seconds on CUDA and worker setup, so the parallel prefetch
+    runs alongside it and weight loading then reads from the page cache. The engine
+    is only returned once checksum verification has passed.
+
+    Args:
+        model_path: Output of prepare_snapshot()
+        manifest: Output of prepare_snapshot()
+        timings: Dict that receives engine and prefetch timings
+
+    Returns:
+        Engine instance
+    """
+    prefetch = {}
+    prefetch_thread = None
+    verify = manifest is not None and VERIFY_WEIGHTS == 'sha256'
+    if model_path and os.path.isdir(model_path) and (PREFETCH_WEIGHTS or verify):
+        def run_prefetch():
+            try:
+                prefetch['result'] = prefetch_weights(model_path, manifest)
+            except Exception as e:
+                prefetch['error'] = e
+        prefetch_thread = threading.Thread(target=run_prefetch, name='ocr-prefetch', daemon=True)
+        prefetch_thread.start()
+
+    start = time.perf_counter()
+    engine = create_engine(model_path)
+    timings['engine_seconds'] = round(time.perf_counter() - start, 2)
+
+    if prefetch_thread is not None:
+        prefetch_thread.join()
+        if 'error' in prefetch:
+            raise prefetch['error']
+        timings['prefetch'] = prefetch['result']
+        logging.info(f"📦 Prefetched {prefetch['result']['files']} weight file(s) "
+                     f"({prefetch['result']['bytes'] / 1e9:.2f} GB) in {prefetch['result']['seconds']}s")
+    return engine
+
+# Startup progress, reported by /health
+STARTUP_STATE = {'phase': 'starting', 'error': None, 'timings': {}}
+
+def initialize_engine(prepared=None):
+    """
+    Load the engine at startup and record progress in STARTUP_STATE
+
+    Args:
+        prepared: Result of prepare_snapshot() when it already ran
+
+    Returns:
+        True when the model is loaded
+    """
+    global llm, MODEL_LOADED
+    logging.info("🔧 Initializing DeepSeek-OCR model with vLLM...")
+    start = time.perf_counter()
+    try:
+        STARTUP_STATE['phase'] = 'validating'
+        model_path, manifest = prepared or prepare_snapshot()
+        STARTUP_STATE['phase'] = 'loading'
+        llm = load_engine(model_path, manifest, STARTUP_STATE['timings'])
+    except Exception as e:
+        STARTUP_STATE.update({'phase': 'failed', 'error': str(e)})
+        logging.error(f"❌ Failed to load DeepSeek-OCR model: {str(e)}")
+        if not isinstance(e, SnapshotError):
+            logging.error("💡 Make sure you have installed vLLM: pip install vllm --pre --extra-index-url https://wheels.vllm.ai/nightly")
+        return False
+
+    STARTUP_STATE['phase'] = 'ready'
+    STARTUP_STATE['timings']['total_seconds'] = round(time.perf_counter() - start, 2)
     logging.info("✅ DeepSeek-OCR model initialized successfully with vLLM!")
     logging.info("🚀 Using vLLM for optimized inference performance")
     MODEL_LOADED = True
+    return True
+
+MODEL_LOADED = False
+llm = None
+
+try:
+    if ENGINE != 'vllm':
+        from types import SimpleNamespace
+        # Sampling parameters are passed through as plain attributes to injected engines
+        SamplingParams = StructuredOutputsParams = SimpleNamespace
+        logging.info(f"🧪 Using injected engine {ENGINE} (DEEPSEEK_OCR_ENGINE) instead of vLLM")
+    else:
+        # Disable HF_TRANSFER which causes issues
+        os.environ['HF_HUB_ENABLE_HF_TRANSFER'] = '0'
+
+        from vllm import SamplingParams, StructuredOutputsParams
+    VLLM_IMPORTED = True
 except Exception as e:
-    logging.error(f"❌ Failed to load DeepSeek-OCR model: {str(e)}")
+    logging.error(f"❌ Failed to import vLLM: {str(e)}")
     logging.error("💡 Make sure you have installed vLLM: pip install vllm --pre --extra-index-url https://wheels.vllm.ai/nightly")
-    MODEL_LOADED = False
-    llm = None
+    VLLM_IMPORTED = False
+    STARTUP_STATE.update({'phase': 'failed', 'error': str(e)})
+
+# Imported by other tools (bulk CLI, benchmarks): load synchronously.
+# Run as the server: the HTTP server starts first and the engine loads in the background.
+if VLLM_IMPORTED and __name__ != '__main__':
+    initialize_engine()
 
 def load_image(image_input):
     """
@@ -123,6 +475,9 @@ def load_image(image_input):
         }
         response = requests.get(image_input, headers=headers, timeout=30)
         response.raise_for_status()
+        if capture is not None and has_request_context():
+            # The capture hashes what was fetched, so a changed remote image is visible on replay
+            g.setdefault('fetched_images', {})[image_input] = response.content
         image = Image.open(io.BytesIO(response.content)).convert("RGB")
     else:
         # Assume it's base64
@@ -132,19 +487,1371 @@ def load_image(image_input):
     
     return image
 
+def build_prompt(custom_text):
+    """
+    Build a DeepSeek-OCR prompt with exactly one <image> token
+
+    Args:
+        custom_text: Instruction text supplied by the client
+
+    Returns:
+        Prompt string
+    """
+    # Remove any existing <image> tokens from custom text to avoid duplicates
+    custom_text = custom_text.replace('<image>', '').strip()
+    return f"<image>\n{custom_text}"
+
+def build_sampling_params(**overrides):
+    """Sampling parameters shared by all OCR endpoints (guided JSON output)"""
+    params = dict(
+        temperature=0.0,  # Deterministic for OCR
+        max_tokens=8192,  # Allow long outputs for documents
+        structured_outputs=StructuredOutputsParams(json=RECEIPT_JSON_SCHEMA),  # Force valid JSON output
+        # ngram logit processor args (improves markdown table generation)
+        extra_args=dict(
+            ngram_size=30,
+            window_size=90,
+            whitelist_token_ids={128821, 128822},  # <td>, </td>
+        ),
+        skip_special_tokens=False,
+    )
+    params.update(overrides)
+    return SamplingParams(**params)
+
+def tiling_error(tiling):
+    """Why a 'tiling' request option is invalid, None when it is True, False or 'auto'"""
+    if tiling is True or tiling is False or tiling == 'auto':
+        return None
+    return f"Invalid tiling option {tiling!r}: expected true, false or \"auto\""
+
+def should_tile(image, tiling='auto'):
+    """
+    Decide whether an image should be split into tiles
+
+    Args:
+        image: PIL Image object
+        tiling: True/False to force, 'auto' to tile when the receipt is taller than TILE_ASPECT_RATIO
+
+    Returns:
+        True if the image should be tiled
+
+    Raises:
+        ValueError: tiling is not True, False or 'auto' (e.g. the string "false")
+    """
+    error = tiling_error(tiling)
+    if error:
+        raise ValueError(error)
+    if tiling == 'auto':
+        return image.height / image.width > TILE_ASPECT_RATIO
+    return tiling
+
+def _tile_bounds(image):
+    """(top, bottom) rows of each tile, see split_into_tiles()"""
+    tile_height = max(1, int(image.width * TILE_HEIGHT_RATIO))
+    if tile_height >= image.height:
+        return [(0, image.height)]
+
+    # Grow tiles until the receipt fits into TILE_MAX_TILES
+    overlap = int(tile_height * TILE_OVERLAP_RATIO)
+    while (image.height - overlap) / (tile_height - overlap) > TILE_MAX_TILES:
+        tile_height = int(tile_height * 1.25)
+        overlap = int(tile_height * TILE_OVERLAP_RATIO)
+
+    bounds = []
+    top = 0
+    while True:
+        bottom = min(top + tile_height, image.height)
+        bounds.append((top, bottom))
+        if bottom >= image.height:
+            break
+        top = bottom - overlap
+    return bounds
+
+def split_into_tiles(image):
+    """
+    Slice a tall receipt into overlapping horizontal tiles
+
+    Every tile spans the full width. Neighbouring tiles share TILE_OVERLAP_RATIO of
+    their height so a line item cut by one tile boundary is fully visible in the
+    other tile. The tile height grows when needed to stay within TILE_MAX_TILES.
+
+    Args:
+        image: PIL Image object
+
+    Returns:
+        List of PIL Image tiles, top to bottom
+    """
+    bounds = _tile_bounds(image)
+    if len(bounds) == 1:
+        return [image]
+    return [image.crop((0, top, image.width, bottom)) for top, bottom in bounds]
+
+def split_tile_overlaps(image):
+    """
+    Crop the bands shared by neighbouring tiles
+
+    Reading these crops tells merge_tile_results() how many line items can actually
+    be duplicated at each tile boundary.
+
+    Args:
+        image: PIL Image object
+
+    Returns:
+        List of PIL Image crops, one per pair of neighbouring tiles (empty when not tiled)
+    """
+    bounds = _tile_bounds(image)
+    return [
+        image.crop((0, next_top, image.width, bottom))
+        for (_, bottom), (next_top, _) in zip(bounds, bounds[1:])
+    ]
+
+def _line_item_key(entry):
+    """Identity of a line item used to detect duplicates in tile overlaps"""
+    return json.dumps(
+        {k: entry.get(k) for k in ('item', 'quantity', 'unit_price', 'total_price')},
+        sort_keys=True
+    )
+
+def merge_tile_results(tile_results, overlap_results):
+    """
+    Merge per-tile JSON arrays into one receipt, dropping duplicates from tile overlaps
+
+    Line items in an overlap band are read by both neighbouring tiles, so they show
+    up at the end of one tile's array and at the start of the next one. Only as many
+    items as were read from the overlap band itself are treated as duplicates: the
+    longest run of identical items within that limit where the previous tile ends and
+    the next tile begins is kept once. Identical line items outside the band (the
+    same product bought twice) are real and kept.
+
+    Args:
+        tile_results: List of parsed JSON arrays, one per tile, top to bottom; None for
+            tiles whose output could not be parsed
+        overlap_results: List of parsed JSON arrays read from split_tile_overlaps(), one
+            per tile boundary; None where the overlap read could not be parsed
+
+    Returns:
+        Merged JSON array
+    """
+    merged = []
+    previous = None
+    for index, entries in enumerate(tile_results):
+        if entries is None:
+            previous = None
+            continue
+        if not isinstance(entries, list):
+            entries = [entries]
+        overlap = 0
+        if previous:
+            band = overlap_results[index - 1]
+            if band is None:
+                # Without an overlap read, fall back to the longest matching run
+                limit = len(previous)
+            else:
+                limit = len(band) if isinstance(band, list) else 1
+            previous_keys = [_line_item_key(e) for e in previous]
+            current_keys = [_line_item_key(e) for e in entries]
+            for size in range(min(limit, len(previous_keys), len(current_keys)), 0, -1):
+                if previous_keys[-size:] == current_keys[:size]:
+                    overlap = size
+                    break
+        merged.extend(entries[overlap:])
+        previous = entries
+    return merged
+
+def merge_tile_outputs(model_outputs, tile_count):
+    """
+    Parse the engine outputs of a tiled image and merge them into one result
+
+    Args:
+        model_outputs: Outputs for the tiles followed by those for the tile overlap bands
+        tile_count: Number of tiles at the start of model_outputs
+
+    Returns:
+        Merged JSON array as a string, '' when no tile output could be parsed
+    """
+    parsed = []
+    for idx, output in enumerate(model_outputs):
+        try:
+            parsed.append(json.loads(output.outputs[0].text))
+        except json.JSONDecodeError as e:
+            logging.warning(f"Tile input {idx + 1}/{len(model_outputs)}: JSON parse failed: {e}")
+            parsed.append(None)
+    tile_results = parsed[:tile_count]
+    if not any(r is not None for r in tile_results):
+        return ''
+    return json.dumps(merge_tile_results(tile_results, parsed[tile_count:]))
+
+def _kv_cache_stats():
+    """
+    KV-cache usage and cumulative preemptions reported by the engine
+
+    vLLM reserves gpu_memory_utilization of the GPU for the KV cache up front, so free
+    device memory does not follow the batch size; preemptions (requests evicted because
+    the KV cache ran out) do.
+
+    Returns:
+        Tuple of (usage fraction, preemption count), either None when not reported
+    """
+    usage = preemptions = None
+    get_metrics = getattr(llm, 'get_metrics', None)
+    if get_metrics is None:
+        return usage, preemptions
+    try:
+        for metric in get_metrics():
+            if metric.name in ('vllm:kv_cache_usage_perc', 'vllm:gpu_cache_usage_perc'):
+                usage = metric.value
+            elif metric.name.startswith('vllm:num_preemptions'):
+                preemptions = metric.value
+    except Exception:
+        pass
+    return usage, preemptions
+
+class BatchAutotuner:
+    """
+    Online tuning of the batch size and batching window
+
+    Every evaluate_every batches the p95 latencies are compared with the target:
+    - a single llm.generate() call above target, or KV-cache preemptions since the last
+      evaluation: shrink the batch size multiplicatively and halve the batching window
+    - full batches while requests queue past the target, or with latency to spare:
+      raise the batch size, unless the last increase lowered token throughput
+    - partly empty batches: halve the window when over target, widen it when well
+      below target so more requests can join, and undo the widening if it did not
+      make batches fuller
+    """
+
+    def __init__(self, target_p95_ms=BATCH_TARGET_P95_MS, max_batch_size=BATCH_MAX_SIZE,
+                 window_ms=BATCH_WINDOW_MS, max_batch_size_limit=BATCH_MAX_SIZE_LIMIT,
+                 window_ms_limit=BATCH_WINDOW_MS_LIMIT, evaluate_every=10, enabled=BATCH_AUTOTUNE):
+        self.target_p95_ms = target_p95_ms
+        self.max_batch_size = max_batch_size
+        self.window_ms = window_ms
+        self.max_batch_size_limit = max_batch_size_limit
+        self.window_ms_limit = window_ms_limit
+        self.evaluate_every = evaluate_every
+        self.enabled = enabled
+        self.decisions = deque(maxlen=20)
+        self._latencies = []
+        self._service_times = []
+        self._batch_sizes = []
+        self._tokens = 0
+        self._busy_seconds = 0.0
+        self._last_throughput = None
+        self._last_action = None
+        self._size_before_grow = None
+        self._ceiling = max_batch_size_limit  # Lowered when growing stops paying off
+        self._window_before_grow = None
+        self._window_ceiling = window_ms_limit
+        self._last_fill = None
+        self._lock = threading.Lock()
+        self.stats = {
+            'batches': 0,
+            'requests': 0,
+            'p95_ms': None,
+            'service_p95_ms': None,
+            'tokens_per_second': None,
+            'kv_cache_usage': None,
+            'preemptions': None
+        }
+        self._last_preemptions = None
+
+    def observe(self, batch_size, elapsed, request_latencies, output_tokens):
+        """
+        Record a finished batch
+
+        Args:
+            batch_size: Number of model inputs in the batch
+            elapsed: Seconds spent in llm.generate()
+            request_latencies: Seconds from submit to result for each request in the batch
+            output_tokens: Generated tokens in the batch
+        """
+        with self._lock:
+            self.stats['batches'] += 1
+            self.stats['requests'] += len(request_latencies)
+            self._latencies.extend(request_latencies)
+            self._service_times.append(elapsed)
+            self._batch_sizes.append(batch_size)
+            self._tokens += output_tokens
+            self._busy_seconds += elapsed
+            if len(self._batch_sizes) >= self.evaluate_every:
+                self._evaluate()
+
+    def _decide(self, action, reason):
+        self.decisions.append({
+            'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'action': action,
+            'reason': reason,
+            'max_batch_size': self.max_batch_size,
+            'window_ms': round(self.window_ms, 1)
+        })
+        logging.info(f"🎛️  Autotuner {action}: {reason} → batch {self.max_batch_size}, window {self.window_ms:.1f} ms")
+
+    def _evaluate(self):
+        latencies = sorted(self._latencies)
+        p95_ms = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] * 1000
+        service = sorted(self._service_times)
+        service_p95_ms = service[min(len(service) - 1, int(0.95 * len(service)))] * 1000
+        throughput = self._tokens / self._busy_seconds if self._busy_seconds else 0.0
+        fill = sum(self._batch_sizes) / (len(self._batch_sizes) * self.max_batch_size)
+        kv_cache_usage, preemptions = _kv_cache_stats()
+        new_preemptions = 0
+        if preemptions is not None and self._last_preemptions is not None:
+            new_preemptions = preemptions - self._last_preemptions
+        self._last_preemptions = preemptions
+        self.stats.update({
+            'p95_ms': round(p95_ms, 1),
+            'service_p95_ms': round(service_p95_ms, 1),
+            'tokens_per_second': round(throughput, 1),
+            'kv_cache_usage': kv_cache_usage,
+            'preemptions': preemptions
+        })
+        self._latencies = []
+        self._service_times = []
+        self._batch_sizes = []
+        self._tokens = 0
+        self._busy_seconds = 0.0
+
+        if not self.enabled:
+            return
+        previous = (self.max_batch_size, self.window_ms)
+        if new_preemptions > 0:
+            # The KV cache cannot hold this many sequences at once
+            self.max_batch_size = max(1, int(self.max_batch_size * 0.75))
+            self.window_ms = max(1.0, self.window_ms / 2)
+            self._ceiling = self.max_batch_size
+            action, reason = 'shrink', f'{new_preemptions:.0f} KV-cache preemption(s)'
+        elif service_p95_ms > self.target_p95_ms:
+            # A single batch already takes longer than the target
+            self.max_batch_size = max(1, int(self.max_batch_size * 0.75))
+            self.window_ms = max(1.0, self.window_ms / 2)
+            self._ceiling = self.max_batch_size
+            self._window_ceiling = self.window_ms_limit
+            action, reason = 'shrink', f'batch p95 {service_p95_ms:.0f} ms > target {self.target_p95_ms:.0f} ms'
+        elif (self._last_action == 'grow_batch' and self._last_throughput
+                and throughput < 0.95 * self._last_throughput):
+            # The last increase did not pay off: go back and stop probing above it
+            self.max_batch_size = self._ceiling = self._size_before_grow
+            action, reason = 'revert', f'throughput fell to {throughput:.0f} tok/s'
+        elif self._last_action == 'grow_window' and fill < 1.1 * self._last_fill:
+            # Waiting longer did not bring more requests into each batch
+            self.window_ms = self._window_ceiling = self._window_before_grow
+            action, reason = 'revert_window', f'batches still {fill:.0%} full'
+        elif fill >= 0.9 and self.max_batch_size < self._ceiling and (
+                p95_ms > self.target_p95_ms or p95_ms < 0.8 * self.target_p95_ms):
+            # Full batches: requests are queueing (or there is latency to spare), so batch more per call
+            self._size_before_grow = self.max_batch_size
+            self.max_batch_size = min(self._ceiling, self.max_batch_size + max(1, self.max_batch_size // 4))
+            action, reason = 'grow_batch', f'batches {fill:.0%} full, p95 {p95_ms:.0f} ms'
+        elif fill < 0.9 and p95_ms > self.target_p95_ms and self.window_ms > 1.0:
+            # Waiting for batches to fill is what costs latency
+            self.window_ms = max(1.0, self.window_ms / 2)
+            action, reason = 'shrink_window', f'batches {fill:.0%} full, p95 {p95_ms:.0f} ms'
+        elif fill < 0.5 and p95_ms < 0.8 * self.target_p95_ms and self.window_ms < self._window_ceiling:
+            self._window_before_grow = self.window_ms
+            self.window_ms = min(self._window_ceiling, self.window_ms * 1.5)
+            action, reason = 'grow_window', f'batches {fill:.0%} full, p95 {p95_ms:.0f} ms'
+        else:
+            action = None
+        self._last_throughput = throughput
+        self._last_fill = fill
+        self._last_action = action
+        if action and (self.max_batch_size, self.window_ms) != previous:
+            self._decide(action, reason)
+
+    def snapshot(self):
+        """Current settings, measurements and recent decisions"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'target_p95_ms': self.target_p95_ms,
+                'max_batch_size': self.max_batch_size,
+                'window_ms': round(self.window_ms, 1),
+                **self.stats,
+                'decisions': list(self.decisions)
+            }
+
+class DynamicBatcher:
+    """
+    Merges concurrent generate requests into one llm.generate() call
+
+    A single worker thread owns the engine. It waits up to the autotuner's batching
+    window for more requests and stops collecting once max_batch_size inputs are
+    queued. A request is never split, so a large /ocr/batch job may run on its own.
+    """
+
+    def __init__(self, generate_fn, autotuner):
+        self.generate_fn = generate_fn
+        self.autotuner = autotuner
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._worker = None
+        self._running = None  # (inputs, started) of the batch inside llm.generate()
+
+    def queue_depth(self):
+        with self._condition:
+            return sum(len(job[0]) for job in self._queue)
+
+    def state(self):
+        """Queued requests and the batch currently inside the engine"""
+        now = time.perf_counter()
+        with self._condition:
+            queued = [{'inputs': len(job[0]), 'waiting_ms': round((now - job[3]) * 1000, 1)} for job in self._queue]
+            running = self._running
+        return {
+            'queued': queued,
+            'running': {'inputs': running[0], 'elapsed_ms': round((now - running[1]) * 1000, 1)} if running else None
+        }
+
+    def submit(self, model_inputs, sampling_params):
+        """
+        Queue model inputs and wait for their outputs
+
+        Args:
+            model_inputs: List of vLLM prompt dicts
+            sampling_params: SamplingParams applied to all inputs of this request
+
+        Returns:
+            List of vLLM outputs, in input order
+
+        Raises:
+            TimeoutError: when no result arrives within BATCH_RESULT_TIMEOUT seconds
+        """
+        future = Future()
+        with self._condition:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='ocr-batcher', daemon=True)
+                self._worker.start()
+            self._queue.append((model_inputs, sampling_params, future, time.perf_counter()))
+            self._condition.notify()
+        return future.result(timeout=BATCH_RESULT_TIMEOUT)
+
+    def _collect(self):
+        with self._condition:
+            while not self._queue:
+                self._condition.wait()
+            jobs = [self._queue.popleft()]
+            size = len(jobs[0][0])
+            deadline = time.perf_counter() + self.autotuner.window_ms / 1000
+            while size < self.autotuner.max_batch_size:
+                if self._queue:
+                    if size + len(self._queue[0][0]) > self.autotuner.max_batch_size:
+                        break
+                    job = self._queue.popleft()
+                    jobs.append(job)
+                    size += len(job[0])
+                    continue
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return jobs
+
+    def _run(self):
+        while True:
+            jobs = self._collect()
+            try:
+                self._process(jobs)
+            except Exception as e:
+                # The worker is the only thread driving the engine and must survive any batch
+                logging.error(f"❌ Batch of {len(jobs)} request(s) failed: {e}")
+                for job in jobs:
+                    if not job[2].done():
+                        job[2].set_exception(e)
+
+    def _process(self, jobs):
+        model_inputs = [model_input for job in jobs for model_input in job[0]]
+        params = [job[1] for job in jobs for _ in job[0]]
+        start = time.perf_counter()
+        self._running = (len(model_inputs), start)
+        try:
+            outputs = self.generate_fn(model_inputs, params)
+        finally:
+            self._running = None
+        finished = time.perf_counter()
+
+        offset = 0
+        for job in jobs:
+            job[2].set_result(outputs[offset:offset + len(job[0])])
+            offset += len(job[0])
+
+        # Bookkeeping runs after every request has its result
+        record_generate_time(len(model_inputs), finished - start)
+        output_tokens = sum(len(getattr(o.outputs[0], 'token_ids', None) or []) for o in outputs)
+        self.autotuner.observe(len(model_inputs), finished - start,
+                               [finished - job[3] for job in jobs], output_tokens)
+
+autotuner = BatchAutotuner()
+batcher = DynamicBatcher(lambda model_inputs, params: llm.generate(model_inputs, params), autotuner)
+
+def generate(model_inputs, sampling_params):
+    """
+    Run the engine, through the dynamic batcher when batching is enabled
+
+    Args:
+        model_inputs: List of vLLM prompt dicts
+        sampling_params: SamplingParams for all inputs
+
+    Returns:
+        List of vLLM outputs, in input order
+    """
+    if BATCHING_ENABLED:
+        return batcher.submit(model_inputs, sampling_params)
+    start = time.perf_counter()
+    outputs = llm.generate(model_inputs, sampling_params)
+    record_generate_time(len(model_inputs), time.perf_counter() - start)
+    return outputs
+
+# Daily pre-screening counters, keyed by UTC date
+PRESCREEN_STATS = {}
+PRESCREEN_STATS_DAYS = 7
+_gpu_seconds_per_image = None  # Moving average of measured engine time per image
+_stats_lock = threading.Lock()
+
+def record_generate_time(num_images, elapsed):
+    """Update the moving average of engine seconds spent per image"""
+    global _gpu_seconds_per_image
+    if num_images <= 0:
+        return
+    per_image = elapsed / num_images
+    with _stats_lock:
+        if _gpu_seconds_per_image is None:
+            _gpu_seconds_per_image = per_image
+        else:
+            _gpu_seconds_per_image = 0.9 * _gpu_seconds_per_image + 0.1 * per_image
+
+def record_prescreen(result):
+    """Count a pre-screen result and the engine time a rejection saved"""
+    day = datetime.now(timezone.utc).date().isoformat()
+    with _stats_lock:
+        stats = PRESCREEN_STATS.setdefault(day, {
+            'screened': 0,
+            'rejected': 0,
+            'flagged': 0,
+            'gpu_seconds_saved': 0.0
+        })
+        stats['screened'] += 1
+        if result['code']:
+            if PRESCREEN_MODE == 'reject':
+                stats['rejected'] += 1
+                stats['gpu_seconds_saved'] += _gpu_seconds_per_image or 0.0
+            else:
+                stats['flagged'] += 1
+        for old_day in sorted(PRESCREEN_STATS)[:-PRESCREEN_STATS_DAYS]:
+            del PRESCREEN_STATS[old_day]
+
+_tesseract_unavailable = False
+
+def _tesseract_text_chars(image):
+    """
+    Count alphanumeric characters found by a quick Tesseract pass
+
+    Runs on a copy reduced to at most PRESCREEN_TESSERACT_MAX_SIDE pixels: the 512 px
+    copy used for the other checks leaves receipt text only a few pixels tall.
+
+    Returns:
+        Character count, None when pytesseract, the tesseract binary or its models are
+        unavailable (the check is then skipped instead of failing the request)
+    """
+    global _tesseract_unavailable
+    if _tesseract_unavailable:
+        return None
+    try:
+        import pytesseract
+        factor = max(1, -(-max(image.size) // PRESCREEN_TESSERACT_MAX_SIDE))
+        grey = (image.reduce(factor) if factor > 1 else image).convert('L')
+        # Fall back to the models installed with tesseract when tessdata/ is not shipped
+        config = '--psm 6'
+        if os.path.isdir(TESSDATA_DIR):
+            config += f' --tessdata-dir "{TESSDATA_DIR}"'
+        text = pytesseract.image_to_string(grey, lang='eng', config=config)
+    except ImportError:
+        _tesseract_unavailable = True
+        return None
+    except (pytesseract.TesseractNotFoundError, pytesseract.TesseractError, OSError) as e:
+        _tesseract_unavailable = True
+        logging.warning(f"⚠️  Tesseract pre-screen disabled: {e}")
+        return None
+    return sum(1 for c in text if c.isalnum())
+
+def prescreen_image(image):
+    """
+    Cheap CPU checks that catch images the model cannot read
+
+    Runs on a downscaled greyscale copy and takes a few milliseconds:
+    exposure (mean grey level and fraction of clipped pixels), contrast, text density
+    (fraction of edge pixels), sharpness (variance of the Laplacian) and, when DEEPSEEK_OCR_PRESCREEN_TESSERACT=1,
+    a quick Tesseract pass on a larger copy with the models in tessdata/.
+
+    Args:
+        image: PIL Image object
+
+    Returns:
+        Dict with 'code' (None when the image looks usable), 'message' and 'metrics'
+    """
+    from PIL import ImageFilter, ImageStat
+
+    start = time.perf_counter()
+    # Integer box reduction is several times faster than thumbnail() for phone-sized photos
+    factor = max(1, -(-max(image.size) // 512))
+    grey = (image.reduce(factor) if factor > 1 else image).convert('L')
+
+    # PIL leaves the outermost pixels unfiltered, so they are cropped before measuring
+    inner = (1, 1, grey.width - 1, grey.height - 1)
+    grey_stat = ImageStat.Stat(grey)
+    brightness = grey_stat.mean[0]
+    contrast = grey_stat.stddev[0]
+    # Clean white paper is mostly clipped too, so clipping alone does not mean overexposed
+    clipped = sum(grey.histogram()[250:]) / (grey.width * grey.height)
+    edges = grey.filter(ImageFilter.FIND_EDGES).crop(inner).point(lambda v: 255 if v > 40 else 0)
+    text_density = ImageStat.Stat(edges).mean[0] / 255
+    laplacian = grey.filter(ImageFilter.Kernel((3, 3), [0, 1, 0, 1, -4, 1, 0, 1, 0], scale=1, offset=128))
+    sharpness = ImageStat.Stat(laplacian.crop(inner)).var[0]
+
+    metrics = {
+        'brightness': round(brightness, 1),
+        'contrast': round(contrast, 1),
+        'clipped': round(clipped, 3),
+        'text_density': round(text_density, 4),
+        'sharpness': round(sharpness, 1)
+    }
+    code = None
+    message = None
+    if brightness < PRESCREEN_MIN_BRIGHTNESS:
+        code, message = 'IMAGE_TOO_DARK', 'Image is too dark to read'
+    elif clipped > PRESCREEN_MAX_CLIPPED and (contrast < PRESCREEN_MIN_CONTRAST
+                                              or text_density < PRESCREEN_MIN_TEXT_DENSITY):
+        code, message = 'IMAGE_OVEREXPOSED', 'Image is overexposed'
+    elif contrast < PRESCREEN_MIN_CONTRAST:
+        code, message = 'IMAGE_BLANK', 'Image is blank'
+    elif sharpness < PRESCREEN_MIN_SHARPNESS:
+        code, message = 'IMAGE_BLURRY', 'Image is too blurry to read'
+    elif text_density < PRESCREEN_MIN_TEXT_DENSITY:
+        code, message = 'IMAGE_BLANK', 'No text-like content found in image'
+    elif PRESCREEN_TESSERACT:
+        text_chars = _tesseract_text_chars(image)
+        if text_chars is not None:
+            metrics['tesseract_chars'] = text_chars
+            if text_chars < 3:
+                code, message = 'NO_TEXT_DETECTED', 'No readable text found in image'
+
+    metrics['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    return {'code': code, 'message': message, 'metrics': metrics}
+
+def screen_image(image, enabled=True):
+    """
+    Pre-screen an image according to PRESCREEN_MODE and record the outcome
+
+    Args:
+        image: PIL Image object
+        enabled: False to skip pre-screening for this request
+
+    Returns:
+        Pre-screen result dict, or None when pre-screening is off
+    """
+    if PRESCREEN_MODE == 'off' or not enabled:
+        return None
+    result = prescreen_image(image)
+    record_prescreen(result)
+    if result['code']:
+        logging.info(f"🔍 Pre-screen {result['code']}: {result['metrics']}")
+    return result
+
+# Resolution cascade counters
+CASCADE_STATS = {
+    'images': 0,
+    'escalated': 0,
+    'low_res_seconds': 0.0,
+    'full_res_seconds': 0.0,
+    'full_res_images': 0
+}
+
+def _parse_amount(value):
+    """Parse a price string such as '12.50', 'CHF 1'234.00' or '3,90' into a float, None if impossible"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    cleaned = ''.join(c for c in str(value) if c.isdigit() or c in '.,-')
+    if not cleaned:
+        return None
+    # The right-most separator is the decimal point
+    decimal_at = max(cleaned.rfind('.'), cleaned.rfind(','))
+    if decimal_at >= 0 and len(cleaned) - decimal_at - 1 <= 2:
+        whole = cleaned[:decimal_at].replace('.', '').replace(',', '')
+        cleaned = f"{whole}.{cleaned[decimal_at + 1:]}"
+    else:
+        cleaned = cleaned.replace('.', '').replace(',', '')
+    try:
+        return float(cleaned)
+    except ValueError:
+        return None
+
+def score_output(output):
+    """
+    Confidence score of a decoded receipt, between 0 and 1
+
+    The score is the weakest of the available signals:
+    - mean token probability from the cumulative log-probability
+    - schema completeness (share of line items with a total_price)
+    - summary.total matching the sum of the item total_price values
+
+    Args:
+        output: vLLM RequestOutput
+
+    Returns:
+        Score between 0.0 and 1.0
+    """
+    completion = output.outputs[0]
+    try:
+        data = json.loads(completion.text)
+    except json.JSONDecodeError:
+        return 0.0
+    entries = [e for e in (data if isinstance(data, list) else [data]) if isinstance(e, dict)]
+    items = [e for e in entries if e.get('item')]
+    if not items:
+        return 0.0
+
+    signals = [sum(1 for e in items if e.get('total_price')) / len(items)]
+
+    token_count = len(getattr(completion, 'token_ids', None) or [])
+    cumulative_logprob = getattr(completion, 'cumulative_logprob', None)
+    if cumulative_logprob is not None and token_count:
+        signals.append(math.exp(cumulative_logprob / token_count))
+
+    totals = [_parse_amount((e.get('summary') or {}).get('total')) for e in entries]
+    totals = [t for t in totals if t is not None]
+    prices = [_parse_amount(e.get('total_price')) for e in items]
+    prices = [p for p in prices if p is not None]
+    if totals and prices:
+        total = totals[-1]
+        signals.append(1.0 if abs(sum(prices) - total) <= max(0.01, 0.01 * abs(total)) else 0.0)
+
+    return min(signals)
+
+def downscale_for_cascade(image):
+    """Downscaled copy for the first cascade pass, None when the image is already small"""
+    scale = CASCADE_MAX_SIDE / max(image.size)
+    if scale >= 1.0:
+        return None
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(size, Image.BILINEAR)
+
+def generate_with_cascade(images, prompt):
+    """
+    Decode images at low resolution first, re-running only low-confidence results at full size
+
+    Args:
+        images: List of PIL Image objects
+        prompt: Prompt built by build_prompt()
+
+    Returns:
+        Tuple of (list of vLLM outputs, list of 'low'/'full' resolution used per image)
+    """
+    outputs = [None] * len(images)
+    resolutions = ['full'] * len(images)
+    low_res = [downscale_for_cascade(img) for img in images]
+    candidates = [idx for idx, img in enumerate(low_res) if img is not None]
+
+    low_elapsed = 0.0
+    if candidates:
+        start = time.perf_counter()
+        low_outputs = generate(
+            [{"prompt": prompt, "multi_modal_data": {"image": low_res[idx]}} for idx in candidates],
+            build_sampling_params(logprobs=1)
+        )
+        low_elapsed = time.perf_counter() - start
+        for idx, output in zip(candidates, low_outputs):
+            score = score_output(output)
+            if score >= CASCADE_THRESHOLD:
+                outputs[idx] = output
+                resolutions[idx] = 'low'
+            else:
+                logging.info(f"🔼 Image {idx + 1}: low-res score {score:.2f} < {CASCADE_THRESHOLD}, escalating")
+
+    pending = [idx for idx in range(len(images)) if outputs[idx] is None]
+    full_elapsed = 0.0
+    if pending:
+        start = time.perf_counter()
+        full_outputs = generate(
+            [{"prompt": prompt, "multi_modal_data": {"image": images[idx]}} for idx in pending],
+            build_sampling_params()
+        )
+        full_elapsed = time.perf_counter() - start
+        for idx, output in zip(pending, full_outputs):
+            outputs[idx] = output
+
+    with _stats_lock:
+        CASCADE_STATS['images'] += len(candidates)
+        CASCADE_STATS['escalated'] += sum(1 for idx in candidates if resolutions[idx] == 'full')
+        CASCADE_STATS['low_res_seconds'] += low_elapsed
+        CASCADE_STATS['full_res_seconds'] += full_elapsed
+        CASCADE_STATS['full_res_images'] += len(pending)
+    return outputs, resolutions
+
+def cascade_summary():
+    """Escalation rate and estimated engine time saved by the resolution cascade"""
+    with _stats_lock:
+        stats = dict(CASCADE_STATS)
+    accepted = stats['images'] - stats['escalated']
+    full_res_per_image = (stats['full_res_seconds'] / stats['full_res_images']
+                          if stats['full_res_images'] else None)
+    seconds_saved = None
+    if full_res_per_image is not None:
+        # Escalated images paid for the low-res pass on top of the full-res one
+        seconds_saved = accepted * full_res_per_image - stats['low_res_seconds']
+    return {
+        'enabled': CASCADE_ENABLED,
+        'threshold': CASCADE_THRESHOLD,
+        'images': stats['images'],
+        'escalated': stats['escalated'],
+        'escalation_rate': stats['escalated'] / stats['images'] if stats['images'] else None,
+        'seconds_saved': seconds_saved
+    }
+
+class RequestCapture:
+    """
+    Append-only log of OCR traffic for deterministic replay
+
+    The request thread only queues what it already has in memory; hashing, image
+    storage and file writes happen on a background writer thread. Each JSONL record
+    holds the arrival time, payload size, prompt and options, per-image SHA-256 and
+    size (of the fetched content for URL inputs), response status, server-side
+    handler time and a hash of every result's raw text.
+    """
+
+    def __init__(self, path, store_images=False):
+        self.path = path
+        self.image_dir = f"{path}.images" if store_images else None
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._run, name='ocr-capture', daemon=True)
+        self._writer.start()
+
+    def record(self, endpoint, arrival, latency, payload_bytes, data, response, fetched=None):
+        self._queue.put((endpoint, arrival, latency, payload_bytes, data, response, fetched or {}))
+
+    def flush(self):
+        """Block until every queued record is written"""
+        self._queue.join()
+
+    def _describe_image(self, image_input, fetched):
+        if isinstance(image_input, str) and image_input.startswith(('http://', 'https://')):
+            raw = fetched.get(image_input)
+            if raw is None:
+                return {'url': image_input, 'sha256': None}
+            description = {'url': image_input}
+        else:
+            try:
+                raw = base64.b64decode(image_input)
+            except Exception:
+                return {'sha256': None, 'bytes': len(image_input or '')}
+            description = {}
+        digest = hashlib.sha256(raw).hexdigest()
+        if self.image_dir:
+            image_path = os.path.join(self.image_dir, digest)
+            if not os.path.exists(image_path):
+                with open(image_path, 'wb') as f:
+                    f.write(raw)
+        return {**description, 'sha256': digest, 'bytes': len(raw)}
+
+    def _run(self):
+        if self.image_dir:
+            os.makedirs(self.image_dir, exist_ok=True)
+        with open(self.path, 'a') as log:
+            while True:
+                endpoint, arrival, latency, payload_bytes, data, response, fetched = self._queue.get()
+                try:
+                    images = [data.get('image')] if endpoint == '/ocr' else data.get('images', [])
+                    results = [response] if endpoint == '/ocr' else response.get('results', [])
+                    entry = {
+                        'arrival': arrival,
+                        'endpoint': endpoint,
+                        'payload_bytes': payload_bytes,
+                        'prompt': data.get('prompt'),
+                        'options': {k: data[k] for k in ('tiling', 'prescreen', 'cascade') if k in data},
+                        'images': [self._describe_image(img, fetched) for img in images if img],
+                        'status': response.get('_status'),
+                        'latency_ms': round(latency * 1000, 2),
+                        'outputs': [
+                            hashlib.sha256((r.get('raw_text') or r.get('text') or '').encode('utf-8')).hexdigest()
+                            if r.get('success') else r.get('error_code') or 'error'
+                            for r in results
+                        ]
+                    }
+                    log.write(json.dumps(entry) + '\n')
+                    log.flush()
+                except Exception as e:
+                    logging.warning(f"Request capture failed: {e}")
+                finally:
+                    self._queue.task_done()
+
+capture = RequestCapture(CAPTURE_PATH, CAPTURE_IMAGES) if CAPTURE_PATH else None
+
+def captured(endpoint):
+    """Record requests to an OCR endpoint when DEEPSEEK_OCR_CAPTURE is set; no-op otherwise"""
+    def decorator(view):
+        if capture is None:
+            return view
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            arrival = time.time()
+            start = time.perf_counter()
+            response = make_response(view(*args, **kwargs))
+            # Timed from tracked()'s start, like its Server-Timing header, so replays compare like with like
+            latency = time.perf_counter() - g.get('request_start', start)
+            body = dict(response.get_json(silent=True) or {})
+            body['_status'] = response.status_code
+            capture.record(endpoint, arrival, latency, request.content_length or 0,
+                           request.get_json(silent=True) or {}, body, g.get('fetched_images'))
+            return response
+        return wrapper
+    return decorator
+
+# Requests currently being handled, for /admin/state
+IN_FLIGHT = {}
+_request_ids = itertools.count(1)
+
+def tracked(endpoint):
+    """
+    Register requests in IN_FLIGHT while they are handled (a dict insert and delete)
+
+    The handler time is returned in a Server-Timing header ("ocr;dur=<ms>"), which
+    excludes upload and download time and so can be compared across clients.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            request_id = next(_request_ids)
+            g.request_start = start = time.perf_counter()
+            IN_FLIGHT[request_id] = (endpoint, start, request.content_length or 0)
+            try:
+                response = make_response(view(*args, **kwargs))
+            finally:
+                IN_FLIGHT.pop(request_id, None)
+            response.headers['Server-Timing'] = f'ocr;dur={(time.perf_counter() - start) * 1000:.2f}'
+            return response
+        return wrapper
+    return decorator
+
+def admin_required(view):
+    """Protect an endpoint with DEEPSEEK_OCR_ADMIN_TOKEN; endpoints do not exist without a token"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({'success': False, 'error': 'Not found'}), 404
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not hmac.compare_digest(supplied.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+            return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+class SamplingProfiler:
+    """
+    Wall-clock sampling profiler over all Python threads
+
+    Samples sys._current_frames() every interval and counts identical stacks.
+    Nothing runs between profiles, so the server pays no cost while it is idle.
+    Output is the folded format read by flamegraph.pl and speedscope:
+    "thread;outer (file:line);inner (file:line) count" per line.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _frame_label(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ':')
+
+    def profile(self, seconds, interval=0.01):
+        """
+        Sample for the given duration
+
+        Args:
+            seconds: Profiling duration
+            interval: Seconds between samples
+
+        Returns:
+            Tuple of (Counter of folded stacks, number of samples), or None if a profile is already running
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            own_thread = threading.get_ident()
+            stacks = Counter()
+            samples = 0
+            deadline = time.perf_counter() + seconds
+            names = {}
+            while time.perf_counter() < deadline:
+                if samples % 100 == 0:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_thread:
+                        continue
+                    labels = []
+                    while frame is not None:
+                        labels.append(self._frame_label(frame))
+                        frame = frame.f_back
+                    thread_name = names.get(thread_id, str(thread_id)).replace(';', ':')
+                    stacks[';'.join([thread_name] + labels[::-1])] += 1
+                samples += 1
+                time.sleep(interval)
+            return stacks, samples
+        finally:
+            self._lock.release()
+
+profiler = SamplingProfiler()
+_memory_snapshot = None
+
+def positive_query_arg(name, default, cast=float, maximum=None):
+    """
+    Read a positive numeric query parameter of an admin request
+
+    Args:
+        name: Query parameter name
+        default: Value when the parameter is absent
+        cast: float or int
+        maximum: Largest accepted value, None for no limit
+
+    Returns:
+        The parsed value
+
+    Raises:
+        ValueError: with a message for the client when the value is not a positive,
+            finite number of the right type or exceeds maximum
+    """
+    raw = request.args.get(name)
+    if raw is None:
+        return default
+    kind = 'a positive integer' if cast is int else 'a positive number'
+    try:
+        value = cast(raw)
+    except ValueError:
+        raise ValueError(f'{name} must be {kind}, got {raw!r}') from None
+    if not (math.isfinite(value) and value > 0):
+        raise ValueError(f'{name} must be {kind}, got {raw!r}')
+    if maximum is not None and value > maximum:
+        raise ValueError(f'{name} must be at most {maximum:g}, got {raw!r}')
+    return value
+
+@app.route('/admin/profile/cpu', methods=['POST'])
+@admin_required
+def admin_profile_cpu():
+    """
+    Sample all threads for N seconds and return folded stacks (flamegraph.pl / speedscope)
+
+    Query parameters: seconds (default 10, at most DEEPSEEK_OCR_PROFILE_MAX_SECONDS),
+    interval_ms (default 10, at least 1)
+    """
+    try:
+        seconds = positive_query_arg('seconds', min(10.0, PROFILE_MAX_SECONDS), maximum=PROFILE_MAX_SECONDS)
+        interval = max(positive_query_arg('interval_ms', 10.0), 1.0) / 1000
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    logging.info(f"🔬 CPU profile started for {seconds:.0f}s")
+    result = profiler.profile(seconds, interval)
+    if result is None:
+        return jsonify({'success': False, 'error': 'A profile is already running'}), 409
+    stacks, samples = result
+    folded = '\n'.join(f"{stack} {count}" for stack, count in stacks.most_common())
+    return folded + '\n', 200, {'Content-Type': 'text/plain', 'X-Profile-Samples': str(samples)}
+
+@app.route('/admin/memory/snapshot', methods=['POST'])
+@admin_required
+def admin_memory_snapshot():
+    """
+    Take a tracemalloc snapshot and diff it against the previous one
+
+    The first call starts tracemalloc (query parameter frames, default 10);
+    later calls return the top allocation sites and the growth since the last call
+    (query parameter top, default 25).
+    """
+    import tracemalloc
+
+    global _memory_snapshot
+    try:
+        top = positive_query_arg('top', 25, cast=int)
+        # tracemalloc keeps at most 65535 frames per traceback
+        frames = positive_query_arg('frames', 10, cast=int, maximum=65535)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+        _memory_snapshot = tracemalloc.take_snapshot()
+        return jsonify({'success': True, 'tracing': True, 'message': 'tracemalloc started, baseline taken'})
+
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__)
+    ])
+    current, peak = tracemalloc.get_traced_memory()
+    response = {
+        'success': True,
+        'tracing': True,
+        'traced_bytes': current,
+        'peak_bytes': peak,
+        'top': [str(stat) for stat in snapshot.statistics('lineno')[:top]],
+        'diff': [str(stat) for stat in snapshot.compare_to(_memory_snapshot, 'lineno')[:top]]
+    }
+    _memory_snapshot = snapshot
+    return jsonify(response)
+
+@app.route('/admin/memory/stop', methods=['POST'])
+@admin_required
+def admin_memory_stop():
+    """Stop tracemalloc and drop the stored snapshot"""
+    import tracemalloc
+
+    global _memory_snapshot
+    tracemalloc.stop()
+    _memory_snapshot = None
+    return jsonify({'success': True, 'tracing': False})
+
+@app.route('/admin/state', methods=['GET'])
+@admin_required
+def admin_state():
+    """Dump in-flight requests, the batcher queue and engine-side state"""
+    now = time.perf_counter()
+    return jsonify({
+        'success': True,
+        'in_flight': [
+            {'id': request_id, 'endpoint': endpoint, 'elapsed_ms': round((now - started) * 1000, 1),
+             'payload_bytes': payload_bytes}
+            for request_id, (endpoint, started, payload_bytes) in sorted(IN_FLIGHT.items())
+        ],
+        'batcher': batcher.state(),
+        'autotuner': autotuner.snapshot(),
+        'threads': [t.name for t in threading.enumerate()]
+    })
+
+# Shutdown and hot reload state
+DRAINING = threading.Event()
+ENGINE_GENERATION = 1
+RELOAD_STATE = {'state': 'idle', 'model_path': None, 'schema_path': None, 'error': None, 'timings': {}}
+
+def model_reload_error():
+    """Why a model snapshot cannot be hot-reloaded in this configuration, None when it can"""
+    if ENGINE == 'vllm' and GPU_MEMORY_UTILIZATION > RELOAD_MAX_GPU_MEMORY_UTILIZATION:
+        return (f'Model hot reload needs room for two engines: DEEPSEEK_OCR_GPU_MEMORY_UTILIZATION is '
+                f'{GPU_MEMORY_UTILIZATION}, set it to {RELOAD_MAX_GPU_MEMORY_UTILIZATION} or lower '
+                f'(or restart the server to switch snapshots)')
+    return None
+_reload_lock = threading.Lock()
+
+def reload_engine(model_path=None, schema_path=None):
+    """
+    Load a new model snapshot and/or schema set, then swap them in atomically
+
+    The current engine keeps serving while the new one loads. Batches already
+    inside llm.generate() finish on the old engine; the next batch uses the new one.
+
+    Args:
+        model_path: Snapshot to load, None to keep the current engine
+        schema_path: JSON file with the receipt schema, None to keep the current schema
+
+    Returns:
+        True when the swap happened
+    """
+    global llm, RECEIPT_JSON_SCHEMA, MODEL_LOADED, ENGINE_GENERATION
+    RELOAD_STATE.update({'state': 'loading', 'model_path': model_path, 'schema_path': schema_path, 'error': None})
+    try:
+        schema = None
+        if schema_path:
+            with open(schema_path) as f:
+                schema = json.load(f)
+            if not isinstance(schema, dict) or 'type' not in schema:
+                raise ValueError('Schema file must contain a JSON schema object')
+        new_engine = None
+        if model_path:
+            reason = model_reload_error()
+            if reason:
+                raise RuntimeError(reason)
+            logging.info(f"🔄 Loading new engine from {model_path} (old engine keeps serving)...")
+            start = time.perf_counter()
+            # Kept apart from STARTUP_STATE so /health still shows the startup measurements
+            RELOAD_STATE['timings'] = {}
+            new_engine = load_engine(*prepare_snapshot(model_path), RELOAD_STATE['timings'])
+            logging.info(f"✅ New engine loaded in {time.perf_counter() - start:.1f}s")
+    except Exception as e:
+        logging.error(f"❌ Reload failed, keeping current engine: {e}")
+        RELOAD_STATE.update({'state': 'failed', 'error': str(e)})
+        return False
+
+    # Plain assignments: a request sees either the old or the new engine and schema
+    old_engine = llm
+    batch_on_old_engine = batcher._running
+    if schema is not None:
+        RECEIPT_JSON_SCHEMA = schema
+    if new_engine is not None:
+        llm = new_engine
+        MODEL_LOADED = True
+        ENGINE_GENERATION += 1
+    RELOAD_STATE['state'] = 'idle'
+    logging.info(f"🔁 Swap complete (engine generation {ENGINE_GENERATION})")
+
+    if new_engine is not None and old_engine is not None:
+        # Release the old engine's GPU memory once the batch it may still be running is done
+        while batch_on_old_engine is not None and batcher._running is batch_on_old_engine:
+            time.sleep(0.05)
+        del old_engine
+        import gc
+        gc.collect()
+        try:
+            import torch
+            torch.cuda.empty_cache()
+        except Exception:
+            pass
+    return True
+
+def drain(timeout=DRAIN_TIMEOUT):
+    """
+    Stop accepting OCR requests and wait for the ones in flight
+
+    Args:
+        timeout: Seconds to wait for in-flight requests
+
+    Returns:
+        True when every in-flight request finished
+    """
+    DRAINING.set()
+    logging.info(f"🛑 Draining: {len(IN_FLIGHT)} request(s) in flight")
+    deadline = time.perf_counter() + timeout
+    while IN_FLIGHT and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    if capture is not None:
+        capture.flush()
+    if IN_FLIGHT:
+        logging.warning(f"⚠️  Drain timed out with {len(IN_FLIGHT)} request(s) in flight")
+        return False
+    logging.info("✅ Drain complete")
+    return True
+
+def handle_sigterm(signum, frame):
+    """Drain in the background and exit once in-flight requests are done"""
+    def drain_and_exit():
+        drained = drain()
+        logging.shutdown()
+        os._exit(0 if drained else 1)
+
+    if not DRAINING.is_set():
+        threading.Thread(target=drain_and_exit, name='ocr-drain', daemon=True).start()
+
+def unavailable_response():
+    """503 response while the server is draining, still loading or has no model, else None"""
+    if DRAINING.is_set():
+        return jsonify({
+            'success': False,
+            'error': 'Server is shutting down. Please retry.'
+        }), 503
+    if STARTUP_STATE['phase'] in ('starting', 'validating', 'loading'):
+        return jsonify({
+            'success': False,
+            'error': 'DeepSeek-OCR model is still loading. Please retry.'
+        }), 503
+    if not MODEL_LOADED:
+        return jsonify({
+            'success': False,
+            'error': 'DeepSeek-OCR model not loaded. Please check server logs.'
+        }), 503
+    return None
+
+@app.route('/admin/reload', methods=['POST'])
+@admin_required
+def admin_reload():
+    """
+    Hot-reload the model snapshot and/or schema set in the background
+
+    Request body:
+    {
+        "model_path": "/models/snapshots/<rev>" (optional),
+        "schema_path": "/config/receipt_schema.json" (optional)
+    }
+
+    The new engine loads next to the serving one, so model_path is rejected unless
+    DEEPSEEK_OCR_GPU_MEMORY_UTILIZATION is at most RELOAD_MAX_GPU_MEMORY_UTILIZATION.
+    """
+    data = request.get_json(silent=True) or {}
+    if not data.get('model_path') and not data.get('schema_path'):
+        return jsonify({'success': False, 'error': 'Provide model_path and/or schema_path'}), 400
+    if data.get('model_path') and model_reload_error():
+        return jsonify({'success': False, 'error': model_reload_error()}), 409
+    if not _reload_lock.acquire(blocking=False):
+        return jsonify({'success': False, 'error': 'A reload is already running'}), 409
+
+    def run():
+        try:
+            reload_engine(data.get('model_path'), data.get('schema_path'))
+        finally:
+            _reload_lock.release()
+
+    threading.Thread(target=run, name='ocr-reload', daemon=True).start()
+    return jsonify({'success': True, 'reload': RELOAD_STATE}), 202
+
+@app.route('/health/live', methods=['GET'])
+def health_live():
+    """
+    Liveness check for the Docker HEALTHCHECK: the process is up and serving HTTP
+
+    Model loading can take minutes and a failed load exits the process, so liveness
+    does not wait for the model. Use /health (503 until loaded) for readiness.
+    """
+    return jsonify({'status': 'alive', 'startup_phase': STARTUP_STATE['phase']})
+
 @app.route('/health', methods=['GET'])
 def health():
-    """Health check endpoint"""
+    """Health check endpoint (readiness: 503 while the model loads or the server drains)"""
+    if DRAINING.is_set():
+        status = 'draining'
+    elif MODEL_LOADED:
+        status = 'ok'
+    else:
+        status = 'loading' if STARTUP_STATE['phase'] != 'failed' else 'error'
     return jsonify({
-        'status': 'ok' if MODEL_LOADED else 'error',
+        'status': status,
         'service': 'DeepSeek-OCR Server (vLLM)',
         'version': '2.0.0',
         'model_loaded': MODEL_LOADED,
         'engine': 'vLLM',
-        'model': 'deepseek-ai/DeepSeek-OCR'
-    })
+        'model': 'deepseek-ai/DeepSeek-OCR',
+        'prescreen': {
+            'mode': PRESCREEN_MODE,
+            'gpu_seconds_per_image': _gpu_seconds_per_image,
+            'daily': PRESCREEN_STATS
+        },
+        'cascade': cascade_summary(),
+        'batching': {
+            'enabled': BATCHING_ENABLED,
+            'queue_depth': batcher.queue_depth(),
+            'autotuner': autotuner.snapshot()
+        },
+        'startup': STARTUP_STATE,
+        'engine_generation': ENGINE_GENERATION,
+        'reload': RELOAD_STATE
+    }), 503 if status in ('draining', 'loading') else 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus-style metrics for batching, pre-screening and the resolution cascade"""
+    tuner = autotuner.snapshot()
+    cascade = cascade_summary()
+    today = PRESCREEN_STATS.get(datetime.now(timezone.utc).date().isoformat(), {})
+    values = {
+        'deepseek_ocr_batch_max_size': tuner['max_batch_size'],
+        'deepseek_ocr_batch_window_ms': tuner['window_ms'],
+        'deepseek_ocr_batch_p95_ms': tuner['p95_ms'],
+        'deepseek_ocr_batch_tokens_per_second': tuner['tokens_per_second'],
+        'deepseek_ocr_batches_total': tuner['batches'],
+        'deepseek_ocr_batch_queue_depth': batcher.queue_depth(),
+        'deepseek_ocr_prescreen_rejected_today': today.get('rejected', 0),
+        'deepseek_ocr_prescreen_gpu_seconds_saved_today': today.get('gpu_seconds_saved', 0.0),
+        'deepseek_ocr_cascade_escalated_total': cascade['escalated'],
+        'deepseek_ocr_cascade_images_total': cascade['images'],
+    }
+    lines = [f"{name} {value}" for name, value in values.items() if value is not None]
+    return '\n'.join(lines) + '\n', 200, {'Content-Type': 'text/plain; version=0.0.4'}
 
 @app.route('/ocr', methods=['POST'])
+@tracked('/ocr')
+@captured('/ocr')
 def perform_ocr():
     """
     Perform OCR on uploaded image using DeepSeek-OCR with vLLM
@@ -152,20 +1859,23 @@ def perform_ocr():
     Request body:
     {
         "image": "https://example.com/image.jpg" OR "base64_encoded_image_data",
-        "prompt": "custom prompt" (optional, defaults to "Free OCR.")
+        "prompt": "custom prompt" (optional, defaults to "Free OCR."),
+        "tiling": "auto" | true | false (optional, split tall receipts into overlapping tiles),
+        "prescreen": true | false (optional, CPU pre-screening for blank/blurry images),
+        "cascade": true | false (optional, try a low-resolution pass first)
     }
     
     Response:
     {
         "success": true,
-        "text": "extracted text"
+        "text": "extracted text",
+        "tiles": 1,
+        "resolution": "low" | "full"
     }
     """
-    if not MODEL_LOADED:
-        return jsonify({
-            'success': False,
-            'error': 'DeepSeek-OCR model not loaded. Please check server logs.'
-        }), 503
+    unavailable = unavailable_response()
+    if unavailable:
+        return unavailable
     
     try:
         data = request.get_json()
@@ -176,17 +1886,31 @@ def perform_ocr():
                 'error': 'No image data provided'
             }), 400
         
+        tiling = data.get('tiling', 'auto')
+        if tiling_error(tiling):
+            return jsonify({
+                'success': False,
+                'error': tiling_error(tiling)
+            }), 400
+        
         # Load image from URL or base64
         image = load_image(data['image'])
         
+        # Reject blank, blurry or badly exposed images before spending GPU time on them
+        screen = screen_image(image, data.get('prescreen', True))
+        if screen and screen['code'] and PRESCREEN_MODE == 'reject':
+            return jsonify({
+                'success': False,
+                'error': screen['message'],
+                'error_code': screen['code'],
+                'prescreen': screen['metrics']
+            }), 422
+        
         # Get custom prompt or use default
         custom_text = data.get('prompt', 'Extract all text and information from this receipt.')
         
-        # Remove any existing <image> tokens from custom text to avoid duplicates
-        custom_text = custom_text.replace('<image>', '').strip()
-        
         # Build prompt: exactly ONE <image> token followed by the instruction
-        prompt = f"<image>\n{custom_text}"
+        prompt = build_prompt(custom_text)
         
         # Validate prompt format
         image_token_count = prompt.count('<image>')
@@ -198,34 +1922,37 @@ def perform_ocr():
                 'error': f'Invalid prompt format: found {image_token_count} <image> tokens, expected 1'
             }), 400
         
-        logging.info(f"Processing image with vLLM (guided JSON)...")
-        logging.info(f"Prompt: {prompt}")
+        # Tall receipts are split into overlapping tiles submitted as one batch, together
+        # with the overlap bands that bound de-duplication at each tile boundary
+        if should_tile(image, tiling):
+            tiles = split_into_tiles(image)
+            overlaps = split_tile_overlaps(image)
+        else:
+            tiles, overlaps = [image], []
         
-        # Prepare input for vLLM
-        model_input = [{
-            "prompt": prompt,
-            "multi_modal_data": {"image": image}
-        }]
-        
-        # Configure sampling parameters with guided JSON output
-        sampling_params = SamplingParams(
-            temperature=0.0,  # Deterministic for OCR
-            max_tokens=8192,  # Allow long outputs for documents
-            structured_outputs=StructuredOutputsParams(json=RECEIPT_JSON_SCHEMA),  # Force valid JSON output
-            # ngram logit processor args (improves markdown table generation)
-            extra_args=dict(
-                ngram_size=30,
-                window_size=90,
-                whitelist_token_ids={128821, 128822},  # <td>, </td>
-            ),
-            skip_special_tokens=False,
-        )
+        logging.info(f"Processing image with vLLM (guided JSON, {len(tiles)} tile(s))...")
+        logging.info(f"Prompt: {prompt}")
         
         # Generate output using vLLM
-        model_outputs = llm.generate(model_input, sampling_params)
+        if len(tiles) == 1 and data.get('cascade', CASCADE_ENABLED):
+            # Tiles are already bounded in size, so only single images go through the cascade
+            model_outputs, resolutions = generate_with_cascade(tiles, prompt)
+        else:
+            model_input = [
+                {
+                    "prompt": prompt,
+                    "multi_modal_data": {"image": tile}
+                }
+                for tile in tiles + overlaps
+            ]
+            model_outputs = generate(model_input, build_sampling_params())
+            resolutions = ['full']
         
         # Extract the generated text (should be valid JSON due to guided_json)
-        result = model_outputs[0].outputs[0].text
+        if len(tiles) == 1:
+            result = model_outputs[0].outputs[0].text
+        else:
+            result = merge_tile_outputs(model_outputs, len(tiles))
         
         if not result:
             return jsonify({
@@ -240,13 +1967,19 @@ def perform_ocr():
             structured_data = json.loads(result)
             logging.info("✅ Successfully parsed structured JSON data")
             
-            return jsonify({
+            response = {
                 'success': True,
                 'engine': 'vLLM',
                 'model': 'deepseek-ai/DeepSeek-OCR',
                 'structured_data': structured_data,
-                'raw_text': result  # Keep raw JSON string for reference
-            })
+                'raw_text': result,  # Keep raw JSON string for reference
+                'tiles': len(tiles),
+                'resolution': resolutions[0]
+            }
+            if screen and screen['code']:
+                response['warning'] = screen['message']
+                response['error_code'] = screen['code']
+            return jsonify(response)
             
         except json.JSONDecodeError as e:
             logging.error(f"JSON parsing failed (should not happen with guided_json): {e}")
@@ -269,6 +2002,8 @@ def perform_ocr():
         }), 500
 
 @app.route('/ocr/batch', methods=['POST'])
+@tracked('/ocr/batch')
+@captured('/ocr/batch')
 def perform_batch_ocr():
     """
     Perform OCR on multiple images using vLLM batch processing
@@ -276,22 +2011,23 @@ def perform_batch_ocr():
     Request body:
     {
         "images": ["https://url1.com/img.jpg", "https://url2.com/img.jpg", ...] OR ["base64_1", "base64_2", ...],
-        "prompt": "custom prompt" (optional)
+        "prompt": "custom prompt" (optional),
+        "tiling": "auto" | true | false (optional, split tall receipts into overlapping tiles),
+        "prescreen": true | false (optional, CPU pre-screening for blank/blurry images),
+        "cascade": true | false (optional, try a low-resolution pass first; untiled images only)
     }
     
     Response:
     {
         "success": true,
-        "results": [{"success": true, "text": "..."}, ...],
+        "results": [{"success": true, "text": "...", "tiles": 1, "resolution": "low"}, {"success": false, "error_code": "IMAGE_BLURRY", ...}, ...],
         "total": 3,
         "successful": 3
     }
     """
-    if not MODEL_LOADED:
-        return jsonify({
-            'success': False,
-            'error': 'DeepSeek-OCR model not loaded. Please check server logs.'
-        }), 503
+    unavailable = unavailable_response()
+    if unavailable:
+        return unavailable
     
     try:
         data = request.get_json()
@@ -304,6 +2040,13 @@ def perform_batch_ocr():
                 'error': 'No images provided'
             }), 400
         
+        tiling = data.get('tiling', 'auto')
+        if tiling_error(tiling):
+            return jsonify({
+                'success': False,
+                'error': tiling_error(tiling)
+            }), 400
+        
         logging.info(f"Processing {len(images_b64)} images in batch with vLLM...")
         
         # Load all images (from URLs or base64)
@@ -319,58 +2062,90 @@ def perform_batch_ocr():
                     'error': f'Failed to load image {idx + 1}: {str(e)}'
                 }), 400
         
+        # Pre-screen on CPU; rejected images never reach the engine
+        results = [None] * len(images)
+        screens = [screen_image(img, data.get('prescreen', True)) for img in images]
+        accepted = []
+        for idx, screen in enumerate(screens):
+            if screen and screen['code'] and PRESCREEN_MODE == 'reject':
+                results[idx] = {
+                    'success': False,
+                    'error': screen['message'],
+                    'error_code': screen['code'],
+                    'prescreen': screen['metrics']
+                }
+            else:
+                accepted.append(idx)
+        
         # Prepare batched input for vLLM (vLLM handles batching efficiently!)
-        # Remove any existing <image> tokens to avoid duplicates
-        custom_prompt = custom_prompt.replace('<image>', '').strip()
-        prompt = f"<image>\n{custom_prompt}"
+        prompt = build_prompt(custom_prompt)
         
         logging.info(f"Batch prompt: {prompt}")
         
-        model_inputs = [
-            {
-                "prompt": prompt,
-                "multi_modal_data": {"image": img}
-            }
-            for img in images
-        ]
-        
-        # Configure sampling parameters with guided JSON
-        sampling_params = SamplingParams(
-            temperature=0.0,
-            max_tokens=8192,
-            guided_json=RECEIPT_JSON_SCHEMA,  # Force valid JSON output
-            extra_args=dict(
-                ngram_size=30,
-                window_size=90,
-                whitelist_token_ids={128821, 128822},
-            ),
-            skip_special_tokens=False,
-        )
+        # Tall receipts are tiled like in /ocr; untiled images go through the cascade when enabled
+        cascade = data.get('cascade', CASCADE_ENABLED)
+        crops = {}
+        for idx in accepted:
+            if should_tile(images[idx], tiling):
+                crops[idx] = (split_into_tiles(images[idx]), split_tile_overlaps(images[idx]))
+            elif not cascade:
+                crops[idx] = ([images[idx]], [])
         
         # Generate outputs in batch (vLLM is optimized for this!)
-        model_outputs = llm.generate(model_inputs, sampling_params)
+        texts = {}
+        cascaded = [idx for idx in accepted if idx not in crops]
+        if cascaded:
+            model_outputs, resolutions = generate_with_cascade([images[idx] for idx in cascaded], prompt)
+            for idx, output, resolution in zip(cascaded, model_outputs, resolutions):
+                texts[idx] = (output.outputs[0].text, 1, resolution)
+        if crops:
+            # All tiles and overlap bands of the batch are submitted in one call
+            model_inputs = [
+                {
+                    "prompt": prompt,
+                    "multi_modal_data": {"image": crop}
+                }
+                for tiles, overlaps in crops.values()
+                for crop in tiles + overlaps
+            ]
+            model_outputs = generate(model_inputs, build_sampling_params())
+            start = 0
+            for idx, (tiles, overlaps) in crops.items():
+                outputs = model_outputs[start:start + len(tiles) + len(overlaps)]
+                start += len(outputs)
+                if len(tiles) == 1:
+                    text = outputs[0].outputs[0].text
+                else:
+                    # Fall back to the raw tile texts when none of them could be parsed
+                    text = merge_tile_outputs(outputs, len(tiles)) or \
+                        '\n'.join(o.outputs[0].text for o in outputs[:len(tiles)])
+                texts[idx] = (text, len(tiles), 'full')
         
         # Extract results and parse JSON
-        results = []
-        for idx, output in enumerate(model_outputs):
-            text = output.outputs[0].text
+        for idx in accepted:
+            text, tile_count, resolution = texts[idx]
             
             # Parse JSON (guided_json ensures valid JSON)
             try:
                 structured_data = json.loads(text)
-                results.append({
+                results[idx] = {
                     'success': True,
                     'structured_data': structured_data,
                     'raw_text': text
-                })
+                }
                 logging.info(f"Image {idx + 1}/{len(images)}: ✅ Parsed JSON ({len(text)} chars)")
             except json.JSONDecodeError as e:
                 logging.warning(f"Image {idx + 1}/{len(images)}: JSON parse failed: {e}")
-                results.append({
+                results[idx] = {
                     'success': True,
                     'text': text,
                     'warning': 'JSON parsing failed'
-                })
+                }
+            results[idx]['tiles'] = tile_count
+            results[idx]['resolution'] = resolution
+            if screens[idx] and screens[idx]['code']:
+                results[idx].setdefault('warning', screens[idx]['message'])
+                results[idx]['error_code'] = screens[idx]['code']
         
         successful = sum(1 for r in results if r.get('success', False))
         
@@ -394,23 +2169,50 @@ def perform_batch_ocr():
         }), 500
 
 if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == '--write-weights-manifest':
+        print(f"📝 Wrote {write_weights_manifest(sys.argv[2])}")
+        sys.exit(0)
+
     print("=" * 70)
     print("🚀 Starting DeepSeek-OCR Server (vLLM-powered)")
     print("=" * 70)
-    
-    if MODEL_LOADED:
-        print("✅ DeepSeek-OCR model loaded successfully with vLLM")
+
+    if not VLLM_IMPORTED:
+        print("❌ Failed to import vLLM")
+        print("💡 Install vLLM: pip install vllm --pre --extra-index-url https://wheels.vllm.ai/nightly")
+    else:
+        # Missing or truncated snapshots fail here, before the server accepts traffic
+        try:
+            prepared = prepare_snapshot()
+        except SnapshotError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+
+        def load_in_background():
+            # A snapshot that fails checksum verification or an engine that cannot load
+            # must not leave a server that only answers 503s behind
+            if not initialize_engine(prepared):
+                os._exit(1)
+
+        # Weights are prefetched and the engine built while the HTTP server starts
+        threading.Thread(target=load_in_background, name='ocr-startup', daemon=True).start()
+        print(f"⏳ Loading DeepSeek-OCR model from {prepared[0] or ENGINE} "
+              f"(prefetch {'on' if PREFETCH_WEIGHTS else 'off'}, verify {VERIFY_WEIGHTS})")
         print("🚀 Using vLLM for optimized inference (much faster!)")
         print("⚡ Supports efficient batch processing")
-    else:
-        print("❌ Failed to load DeepSeek-OCR model")
-        print("💡 Check the logs above for error details")
-        print("💡 Install vLLM: pip install vllm --pre --extra-index-url https://wheels.vllm.ai/nightly")
     
     print("")
     print("📍 Server will run on: http://localhost:5003")
     print("🔍 Endpoints:")
-    print("   - GET  /health       → Health check")
+    print("   - GET  /health       → Health check (503 while the model loads)")
+    print("   - GET  /health/live  → Liveness check (Docker HEALTHCHECK)")
+    print("   - GET  /metrics      → Batching, pre-screen and cascade metrics")
+    if ADMIN_TOKEN:
+        print("   - POST /admin/profile/cpu, /admin/memory/snapshot, GET /admin/state → Profiling (token)")
+        print("   - POST /admin/reload → Hot-swap model snapshot or schema (token)")
+        if model_reload_error():
+            print(f"     Model snapshots need DEEPSEEK_OCR_GPU_MEMORY_UTILIZATION <= {RELOAD_MAX_GPU_MEMORY_UTILIZATION}; "
+                  "schema reloads always work")
     print("   - POST /ocr          → Single image OCR")
     print("   - POST /ocr/batch    → Batch image OCR (optimized!)")
     print("")
@@ -427,5 +2229,7 @@ if __name__ == '__main__':
     print("🔗 Based on: https://docs.vllm.ai/projects/recipes/en/latest/DeepSeek/DeepSeek-OCR.html")
     print("=" * 70)
     
+    # Drain in-flight requests before exiting on SIGTERM (docker stop, Kubernetes)
+    signal.signal(signal.SIGTERM, handle_sigterm)
     app.run(host='0.0.0.0', port=5003, debug=False)
 
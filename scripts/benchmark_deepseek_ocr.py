@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the DeepSeek-OCR server using the stub engine
+No GPU or model weights are needed: the server is imported with the stub engine
+from stub_engine.py injected (DEEPSEEK_OCR_ENGINE=stub_engine:create_engine) and
+fed synthetic receipts.
+
+Usage:
+    python3 benchmark_deepseek_ocr.py tiling
+    python3 benchmark_deepseek_ocr.py prescreen
+    python3 benchmark_deepseek_ocr.py cascade
+    python3 benchmark_deepseek_ocr.py autotune
+    python3 benchmark_deepseek_ocr.py profiling
+    python3 benchmark_deepseek_ocr.py reload
+    python3 benchmark_deepseek_ocr.py coldstart
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault('DEEPSEEK_OCR_ENGINE', 'stub_engine:create_engine')
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(1, str(Path(__file__).resolve().parent.parent))
+
+import deepseek_ocr_server as server  # noqa: E402
+from stub_engine import StubLLM, make_synthetic_receipt  # noqa: E402
+
+
+def run_ocr(images):
+    """Run one engine batch and return (parsed JSON arrays, seconds)"""
+    prompt = server.build_prompt('Free OCR.')
+    start = time.perf_counter()
+    outputs = server.llm.generate(
+        [{"prompt": prompt, "multi_modal_data": {"image": img}} for img in images],
+        server.build_sampling_params()
+    )
+    elapsed = time.perf_counter() - start
+    return [json.loads(o.outputs[0].text) for o in outputs], elapsed
+
+
+def bench_tiling(args):
+    """Compare single-image and tiled OCR on synthetic tall receipts, with and without repeated lines"""
+    from collections import Counter
+
+    def score(found, expected):
+        # Receipt lines are a multiset: a product bought three times must appear three times
+        matched = sum((Counter(found) & Counter(expected)).values())
+        return matched / len(expected), len(found) - matched, len(expected) - matched
+
+    print("📏 Long-receipt tiling: single image vs overlapping tiles")
+    print(f"{'items':>6} {'repeat':>6} {'ratio':>6} {'tiles':>6} {'single acc':>11} {'tiled acc':>10} "
+          f"{'extra':>6} {'missing':>8} {'unbounded missing':>18} {'single ms':>10} {'tiled ms':>9}")
+
+    for repeat in args.repeat:
+        for num_items in args.items:
+            image, expected = make_synthetic_receipt(-(-num_items // repeat), repeat=repeat)
+
+            single, single_time = run_ocr([image])
+            single_acc, _, _ = score([e['item'] for e in single[0]], expected)
+
+            tiles = server.split_into_tiles(image)
+            overlaps = server.split_tile_overlaps(image)
+            parsed, tiled_time = run_ocr(tiles + overlaps)
+            per_tile, per_overlap = parsed[:len(tiles)], parsed[len(tiles):]
+            merged = server.merge_tile_results(per_tile, per_overlap)
+            tiled_acc, extra, missing = score([e['item'] for e in merged], expected)
+
+            # Longest-run de-duplication without the overlap reads, for comparison
+            unbounded = server.merge_tile_results(per_tile, [None] * len(per_overlap))
+            _, _, unbounded_missing = score([e['item'] for e in unbounded], expected)
+
+            print(f"{len(expected):>6} {repeat:>6} {image.height / image.width:>6.1f} {len(tiles):>6} "
+                  f"{single_acc:>10.0%} {tiled_acc:>10.0%} {extra:>6} {missing:>8} {unbounded_missing:>18} "
+                  f"{single_time * 1000:>10.1f} {tiled_time * 1000:>9.1f}")
+
+
+def make_white_document(width, height, line_spacing, font_size):
+    """Black text lines on clipped white paper, as a well-exposed scan or photo looks"""
+    from PIL import Image, ImageDraw, ImageFont
+
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=font_size)
+    margin = width // 16
+    for index, top in enumerate(range(line_spacing, height - line_spacing, line_spacing)):
+        draw.text((margin, top), f'ITEM {index:04d} GROCERIES', fill='black', font=font)
+        draw.text((width - margin, top), f'{index % 97}.{index % 100:02d}', fill='black', font=font, anchor='ra')
+    return image
+
+
+def bench_prescreen(args):
+    """Time the CPU pre-screen and compare it with the engine time it saves"""
+    from PIL import Image, ImageFilter
+
+    receipt, _ = make_synthetic_receipt(40)
+    white_receipt = make_white_document(800, 4800, 30, 20)
+    fixtures = {
+        'receipt': receipt,
+        # Clean white paper must pass: most pixels are clipped but the text keeps contrast
+        'white_rcpt': white_receipt,
+        'white_photo': make_white_document(3024, 4032, 240, 56),
+        # Washed out: text faded to near-white on blown-out paper
+        'overexposed': white_receipt.point(lambda v: 255 - (255 - v) // 24),
+        'blank': Image.new('RGB', receipt.size, (235, 232, 228)),
+        'blurry': receipt.filter(ImageFilter.GaussianBlur(12)),
+        'dark': receipt.point(lambda v: v // 8),
+        'pocket': Image.new('RGB', receipt.size, (12, 10, 14)),
+    }
+
+    _, engine_time = run_ocr([receipt])
+    print("🔍 CPU pre-screen vs engine time")
+    print(f"   Engine time per image (stub): {engine_time * 1000:.1f} ms")
+    print(f"{'fixture':>11} {'code':>18} {'ms':>8} {'sharpness':>10} {'density':>8} {'brightness':>11} "
+          f"{'clipped':>8}")
+    for name, image in fixtures.items():
+        timings = []
+        for _ in range(args.repeat):
+            result = server.prescreen_image(image)
+            timings.append(result['metrics']['elapsed_ms'])
+        metrics = result['metrics']
+        print(f"{name:>11} {result['code'] or 'OK':>18} {sorted(timings)[len(timings) // 2]:>8.2f} "
+              f"{metrics['sharpness']:>10.1f} {metrics['text_density']:>8.4f} {metrics['brightness']:>11.1f} "
+              f"{metrics['clipped']:>8.3f}")
+
+
+def bench_cascade(args):
+    """Compare always-full-resolution decoding with the low-res-first cascade"""
+    import random
+
+    rng = random.Random(args.seed)
+    fixtures = []
+    for _ in range(args.images):
+        if rng.random() < args.fine_print:
+            # Small print on a wide, high-resolution capture: illegible once downscaled
+            fixtures.append(make_synthetic_receipt(rng.randint(15, 30), width=1200, band_height=10, gap=8))
+        else:
+            fixtures.append(make_synthetic_receipt(rng.randint(10, 20), width=900))
+    images = [image for image, _ in fixtures]
+    prompt = server.build_prompt('Free OCR.')
+
+    def accuracy(outputs):
+        found = [{e['item'] for e in json.loads(o.outputs[0].text)} for o in outputs]
+        return sum(len(f & set(expected)) / len(expected)
+                   for f, (_, expected) in zip(found, fixtures)) / len(fixtures)
+
+    start = time.perf_counter()
+    full_outputs = server.llm.generate(
+        [{"prompt": prompt, "multi_modal_data": {"image": img}} for img in images],
+        server.build_sampling_params()
+    )
+    full_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cascade_outputs, resolutions = server.generate_with_cascade(images, prompt)
+    cascade_time = time.perf_counter() - start
+
+    summary = server.cascade_summary()
+    print("🔼 Resolution cascade vs full resolution")
+    print(f"   Images: {len(images)} ({args.fine_print:.0%} fine print), threshold {server.CASCADE_THRESHOLD}")
+    print(f"   Full resolution: {full_time * 1000:8.1f} ms, accuracy {accuracy(full_outputs):.0%}")
+    print(f"   Cascade:         {cascade_time * 1000:8.1f} ms, accuracy {accuracy(cascade_outputs):.0%}")
+    print(f"   Escalated: {resolutions.count('full')}/{len(images)} "
+          f"({summary['escalation_rate']:.0%}), estimated saved {summary['seconds_saved'] * 1000:.1f} ms")
+
+    # Decision logic with canned confidences: only the 0.5 output is escalated
+    canned = StubLLM(confidences=[0.95, 0.5, 0.9])
+    engine, server.llm = server.llm, canned
+    try:
+        _, canned_resolutions = server.generate_with_cascade(images[:3], prompt)
+    finally:
+        server.llm = engine
+    print(f"   Canned confidences [0.95, 0.5, 0.9] -> {canned_resolutions}")
+
+
+def bench_autotune(args):
+    """Closed-loop clients against the dynamic batcher, with and without autotuning"""
+    import threading
+
+    image, _ = make_synthetic_receipt(15)
+    prompt = server.build_prompt('Free OCR.')
+
+    def run(autotune):
+        tuner = server.BatchAutotuner(target_p95_ms=args.target_p95_ms, max_batch_size=1,
+                                      window_ms=1.0, evaluate_every=5, enabled=autotune)
+        batcher = server.DynamicBatcher(server.llm.generate, tuner)
+        latencies = []
+        stop = time.perf_counter() + args.duration
+
+        def client():
+            while time.perf_counter() < stop:
+                start = time.perf_counter()
+                batcher.submit([{"prompt": prompt, "multi_modal_data": {"image": image}}],
+                               server.build_sampling_params())
+                latencies.append(time.perf_counter() - start)
+
+        threads = [threading.Thread(target=client) for _ in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        latencies.sort()
+        p95 = latencies[int(0.95 * (len(latencies) - 1))] * 1000
+        return len(latencies) / args.duration, p95, tuner.snapshot()
+
+    print(f"🎛️  Batch autotuning: {args.clients} clients, target p95 {args.target_p95_ms:.0f} ms")
+    for label, autotune in (('fixed batch 1', False), ('autotuned', True)):
+        throughput, p95, snapshot = run(autotune)
+        print(f"   {label:>14}: {throughput:6.1f} images/s, p95 {p95:7.1f} ms, "
+              f"final batch {snapshot['max_batch_size']}, window {snapshot['window_ms']} ms")
+        if autotune:
+            for decision in snapshot['decisions']:
+                print(f"      {decision['action']:>11} → batch {decision['max_batch_size']:>3}, "
+                      f"window {decision['window_ms']:>6} ms ({decision['reason']})")
+
+
+def bench_profiling(args):
+    """Overhead of the profiling hooks, inactive and while a CPU profile is running"""
+    import base64
+    import io
+    import statistics
+    import threading
+
+    image, _ = make_synthetic_receipt(15)
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    body = {'image': base64.b64encode(buffer.getvalue()).decode('ascii'), 'prescreen': False}
+    client = server.app.test_client()
+
+    def request_latencies():
+        latencies = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            client.post('/ocr', json=body)
+            latencies.append(time.perf_counter() - start)
+        return statistics.median(latencies) * 1000
+
+    # Inactive: in-flight tracking (and its Server-Timing header) is the only hook on the request path
+    tracked = server.tracked('/bench')(lambda: '')
+    with server.app.test_request_context('/bench', method='POST'):
+        start = time.perf_counter()
+        for _ in range(args.calls):
+            tracked()
+        tracking_us = (time.perf_counter() - start) / args.calls * 1e6
+        start = time.perf_counter()
+        for _ in range(args.calls):
+            pass
+        tracking_us -= (time.perf_counter() - start) / args.calls * 1e6
+
+    request_latencies()  # Warm-up
+    idle_ms = request_latencies()
+    profile = threading.Thread(target=server.profiler.profile, args=(args.requests * idle_ms / 1000 * 1.5,))
+    profile.start()
+    profiling_ms = request_latencies()
+    profile.join()
+
+    print("🔬 Profiling hook overhead (stub engine)")
+    print(f"   In-flight tracking:    {tracking_us:8.2f} µs per request")
+    print(f"   /ocr median, idle:     {idle_ms:8.2f} ms")
+    print(f"   /ocr median, profiling:{profiling_ms:8.2f} ms ({(profiling_ms / idle_ms - 1):+.1%})")
+    print(f"   Inactive overhead:     {tracking_us / 1000 / idle_ms:.4%} of a request")
+
+
+def bench_reload(args):
+    """Hot-swap the engine and then drain while clients keep sending requests"""
+    import base64
+    import io
+    import tempfile
+    import threading
+    from collections import Counter
+
+    # The stub engine "loads" the snapshot's weight files, so reload needs a real directory
+    snapshot = tempfile.mkdtemp(prefix='stub-snapshot-')
+    with open(os.path.join(snapshot, 'model.safetensors'), 'wb') as f:
+        f.write(b'\0' * 1024 * 1024)
+
+    image, _ = make_synthetic_receipt(15)
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    body = {'image': base64.b64encode(buffer.getvalue()).decode('ascii'), 'prescreen': False}
+
+    statuses = Counter()
+    stop = threading.Event()
+    lock = threading.Lock()
+
+    def client():
+        test_client = server.app.test_client()
+        while not stop.is_set():
+            status = test_client.post('/ocr', json=body).status_code
+            with lock:
+                statuses[status] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(args.clients)]
+    for thread in threads:
+        thread.start()
+
+    time.sleep(1.0)
+    os.environ['DEEPSEEK_OCR_STUB_LOAD_SECONDS'] = str(args.load_seconds)
+    generation = server.ENGINE_GENERATION
+    start = time.perf_counter()
+    server.reload_engine(model_path=snapshot)
+    reload_seconds = time.perf_counter() - start
+    time.sleep(1.0)
+    with lock:
+        during_reload = dict(statuses)
+
+    drain_start = time.perf_counter()
+    drained = server.drain(timeout=30)
+    drain_seconds = time.perf_counter() - drain_start
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    dropped = sum(count for status, count in during_reload.items() if status != 200)
+    print("🔁 Hot reload and drain under load (stub engine)")
+    print(f"   Clients: {args.clients}, engine generation {generation} → {server.ENGINE_GENERATION}, "
+          f"reload took {reload_seconds:.1f}s")
+    print(f"   Responses before drain: {during_reload} → dropped {dropped}")
+    print(f"   Drain: {'complete' if drained else 'timed out'} in {drain_seconds * 1000:.0f} ms, "
+          f"in flight afterwards {len(server.IN_FLIGHT)}, "
+          f"rejected after drain started {statuses[503]}")
+
+
+def evict_from_page_cache(paths):
+    """Drop clean pages of the given files so the next read goes to disk"""
+    for path in paths:
+        with open(path, 'rb') as f:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def bench_coldstart(args):
+    """Cold-start time with and without the parallel weight prefetch, using dummy weight files"""
+    import shutil
+    import tempfile
+
+    snapshot = tempfile.mkdtemp(prefix='coldstart-snapshot-', dir=args.dir)
+    try:
+        chunk = os.urandom(1024 * 1024)
+        paths = []
+        for index in range(args.files):
+            path = os.path.join(snapshot, f'model-{index + 1:05d}-of-{args.files:05d}.safetensors')
+            with open(path, 'wb') as f:
+                for _ in range(args.file_mb):
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            paths.append(path)
+        server.write_weights_manifest(snapshot)
+
+        # The stub engine spends init_seconds on "CUDA setup", then reads the weights serially
+        os.environ['DEEPSEEK_OCR_STUB_LOAD_SECONDS'] = str(args.init_seconds)
+        print(f"🧊 Cold start with {args.files} x {args.file_mb} MB dummy weight files, "
+              f"{args.init_seconds}s simulated engine setup, {server.PREFETCH_WORKERS} prefetch workers")
+        print(f"   {'prefetch':>9} {'verify':>7} {'total (s)':>10} {'prefetch (s)':>13}")
+        for prefetch, verify in [(False, 'size'), (True, 'size'), (False, 'sha256'), (True, 'sha256')]:
+            server.PREFETCH_WEIGHTS = prefetch
+            server.VERIFY_WEIGHTS = verify
+            timings = []
+            for _ in range(args.repeat):
+                evict_from_page_cache(paths)
+                load_timings = {}
+                start = time.perf_counter()
+                server.load_engine(*server.prepare_snapshot(snapshot), load_timings)
+                timings.append((time.perf_counter() - start, load_timings.get('prefetch', {}).get('seconds')))
+            total = sorted(t for t, _ in timings)[len(timings) // 2]
+            prefetch_seconds = sorted(p for _, p in timings)[len(timings) // 2] if timings[0][1] is not None else '-'
+            print(f"   {'on' if prefetch else 'off':>9} {verify:>7} {total:>10.2f} {prefetch_seconds:>13}")
+    finally:
+        shutil.rmtree(snapshot)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    tiling = subparsers.add_parser('tiling', help='Long-receipt tiling accuracy and latency')
+    tiling.add_argument('--items', type=int, nargs='+', default=[20, 50, 100, 200])
+    tiling.add_argument('--repeat', type=int, nargs='+', default=[1, 6],
+                        help='Times each line item repeats in a row (1 = all lines unique)')
+    tiling.set_defaults(func=bench_tiling)
+
+    prescreen = subparsers.add_parser('prescreen', help='CPU pre-screen latency and verdicts')
+    prescreen.add_argument('--repeat', type=int, default=20)
+    prescreen.set_defaults(func=bench_prescreen)
+
+    cascade = subparsers.add_parser('cascade', help='Low-res-first cascade escalation rate and latency')
+    cascade.add_argument('--images', type=int, default=16)
+    cascade.add_argument('--fine-print', type=float, default=0.25, help='Share of fine-print receipts')
+    cascade.add_argument('--seed', type=int, default=0)
+    cascade.set_defaults(func=bench_cascade)
+
+    autotune = subparsers.add_parser('autotune', help='Batch size / window autotuning under load')
+    autotune.add_argument('--clients', type=int, default=32)
+    autotune.add_argument('--duration', type=float, default=20.0, help='Seconds per run')
+    autotune.add_argument('--target-p95-ms', type=float, default=1500.0)
+    autotune.set_defaults(func=bench_autotune)
+
+    profiling = subparsers.add_parser('profiling', help='Overhead of the admin profiling hooks')
+    profiling.add_argument('--requests', type=int, default=30)
+    profiling.add_argument('--calls', type=int, default=100000)
+    profiling.set_defaults(func=bench_profiling)
+
+    reload = subparsers.add_parser('reload', help='No dropped requests during hot reload and drain')
+    reload.add_argument('--clients', type=int, default=16)
+    reload.add_argument('--load-seconds', type=float, default=3.0, help='Simulated weight loading time')
+    reload.set_defaults(func=bench_reload)
+
+    coldstart = subparsers.add_parser('coldstart', help='Startup time with and without weight prefetch')
+    coldstart.add_argument('--files', type=int, default=4)
+    coldstart.add_argument('--file-mb', type=int, default=256)
+    coldstart.add_argument('--init-seconds', type=float, default=2.0, help='Simulated engine setup before weight loading')
+    coldstart.add_argument('--repeat', type=int, default=3)
+    coldstart.add_argument('--dir', help='Where to create the dummy snapshot (default: system temp dir)')
+    coldstart.set_defaults(func=bench_coldstart)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
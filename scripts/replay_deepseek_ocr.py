@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Replay captured DeepSeek-OCR traffic against a server
+Re-issues the requests recorded with DEEPSEEK_OCR_CAPTURE at their original
+arrival offsets (optionally sped up or slowed down), then compares the latency
+distribution and per-image outputs with the capture. Latencies are compared on
+server-side handler time (the capture's latency_ms and the Server-Timing header
+of each replayed response), so upload and download time do not skew them.
+
+Usage:
+    # On the server being profiled
+    DEEPSEEK_OCR_CAPTURE=/data/capture.jsonl DEEPSEEK_OCR_CAPTURE_IMAGES=1 python3 deepseek_ocr_server.py
+
+    # Later, against any server
+    python3 replay_deepseek_ocr.py /data/capture.jsonl --target http://localhost:5003
+    python3 replay_deepseek_ocr.py /data/capture.jsonl --target http://localhost:5003 --speed 2 --report report.json
+
+Base64 uploads can only be replayed when their images were captured
+(DEEPSEEK_OCR_CAPTURE_IMAGES=1); URL inputs are fetched again by the server. URL
+images are fetched once by this script too and compared with the captured content
+hash, so outputs that differ because the remote image changed are reported apart.
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def load_capture(path):
+    """Captured requests ordered by arrival time"""
+    with open(path) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    return sorted(entries, key=lambda e: e['arrival'])
+
+
+def build_payload(entry, image_dir):
+    """Rebuild the request body, None when an image was not captured or the request had none"""
+    if not entry.get('images'):
+        # Rejected requests (no image, non-JSON body) are captured without inputs to replay
+        return None
+    images = []
+    for image in entry['images']:
+        if 'url' in image:
+            images.append(image['url'])
+            continue
+        image_path = os.path.join(image_dir, image['sha256'] or '')
+        if not image['sha256'] or not os.path.exists(image_path):
+            return None
+        with open(image_path, 'rb') as f:
+            images.append(base64.b64encode(f.read()).decode('ascii'))
+
+    payload = dict(entry.get('options') or {})
+    if entry.get('prompt') is not None:
+        payload['prompt'] = entry['prompt']
+    if entry['endpoint'] == '/ocr':
+        payload['image'] = images[0]
+    else:
+        payload['images'] = images
+    return payload
+
+
+def server_time_ms(response):
+    """Handler time from the Server-Timing header ("ocr;dur=<ms>"), None when absent"""
+    for metric in response.headers.get('Server-Timing', '').split(','):
+        name, _, params = metric.strip().partition(';')
+        if name == 'ocr' and params.startswith('dur='):
+            return float(params[4:])
+    return None
+
+
+def changed_urls(entries, timeout):
+    """URL inputs whose current content no longer matches the captured SHA-256"""
+    changed = set()
+    checked = set()
+    for entry in entries:
+        for image in entry.get('images') or []:
+            if 'url' not in image or not image.get('sha256') or image['url'] in checked:
+                continue
+            checked.add(image['url'])
+            try:
+                response = requests.get(image['url'], timeout=timeout)
+                response.raise_for_status()
+                if hashlib.sha256(response.content).hexdigest() != image['sha256']:
+                    changed.add(image['url'])
+            except Exception:
+                changed.add(image['url'])
+    return changed
+
+
+def output_hashes(endpoint, body):
+    """Same per-image output fingerprint as RequestCapture"""
+    results = [body] if endpoint == '/ocr' else body.get('results', [])
+    return [
+        hashlib.sha256((r.get('raw_text') or r.get('text') or '').encode('utf-8')).hexdigest()
+        if r.get('success') else r.get('error_code') or 'error'
+        for r in results
+    ]
+
+
+def percentiles(values):
+    """p50/p90/p95/p99 of a list of numbers"""
+    if not values:
+        return {}
+    ordered = sorted(values)
+    return {
+        f'p{q}': round(ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))], 1)
+        for q in (50, 90, 95, 99)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('capture', help='Capture JSONL written by the server')
+    parser.add_argument('--target', default='http://localhost:5003', help='Server base URL')
+    parser.add_argument('--speed', type=float, default=1.0, help='Rate multiplier (2 = twice as fast, 0 = as fast as possible)')
+    parser.add_argument('--images', help='Captured image directory (default: <capture>.images)')
+    parser.add_argument('--concurrency', type=int, default=64, help='Maximum requests in flight')
+    parser.add_argument('--timeout', type=float, default=300.0)
+    parser.add_argument('--report', help='Write the comparison as JSON to this file')
+    args = parser.parse_args()
+
+    entries = load_capture(args.capture)
+    image_dir = args.images or f"{args.capture}.images"
+    if not entries:
+        print("❌ Capture is empty")
+        sys.exit(1)
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=args.concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    replayed = []
+    skipped = 0
+    lock = threading.Lock()
+
+    def send(entry, payload):
+        start = time.perf_counter()
+        server_ms = None
+        try:
+            response = session.post(f"{args.target.rstrip('/')}{entry['endpoint']}", json=payload, timeout=args.timeout)
+            status = response.status_code
+            server_ms = server_time_ms(response)
+            body = response.json()
+        except Exception as e:
+            status, body = None, {'success': False, 'error_code': f'client_error: {e}'}
+        round_trip_ms = (time.perf_counter() - start) * 1000
+        with lock:
+            replayed.append((entry, status, server_ms, round_trip_ms, output_hashes(entry['endpoint'], body)))
+
+    changed = changed_urls(entries, args.timeout)
+    if changed:
+        print(f"⚠️  {len(changed)} URL image(s) changed since capture; their outputs are compared separately")
+
+    print(f"▶️  Replaying {len(entries)} request(s) against {args.target} at {args.speed}x")
+    first_arrival = entries[0]['arrival']
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for entry in entries:
+            payload = build_payload(entry, image_dir)
+            if payload is None:
+                skipped += 1
+                continue
+            if args.speed > 0:
+                delay = (entry['arrival'] - first_arrival) / args.speed - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            executor.submit(send, entry, payload)
+    wall_seconds = time.perf_counter() - started
+
+    captured_latency = [e['latency_ms'] for e, _, _, _, _ in replayed]
+    replay_latency = [server_ms for _, _, server_ms, _, _ in replayed if server_ms is not None]
+    round_trip_latency = [round_trip for _, _, _, round_trip, _ in replayed]
+    if len(replay_latency) < len(replayed):
+        print("⚠️  Target did not return Server-Timing for every request; "
+              "server-side latency covers only the ones that did")
+    status_mismatches = sum(1 for e, status, _, _, _ in replayed if status != e.get('status'))
+
+    def image_changed(entry, index):
+        images = entry.get('images') or []
+        return index < len(images) and images[index].get('url') in changed
+
+    compared = []
+    compared_changed = []
+    for e, _, _, _, hashes in replayed:
+        for index, (a, b) in enumerate(zip(e['outputs'], hashes)):
+            (compared_changed if image_changed(e, index) else compared).append((a, b))
+    matching = sum(1 for a, b in compared if a == b)
+
+    report = {
+        'requests': len(entries),
+        'replayed': len(replayed),
+        'skipped': skipped,
+        'wall_seconds': round(wall_seconds, 2),
+        'latency_ms': {
+            'captured': percentiles(captured_latency),
+            'replayed': percentiles(replay_latency),
+            'replayed_round_trip': percentiles(round_trip_latency)
+        },
+        'status_mismatches': status_mismatches,
+        'outputs_compared': len(compared),
+        'outputs_matching': matching,
+        'changed_url_images': len(changed),
+        'outputs_with_changed_images': len(compared_changed),
+        'outputs_with_changed_images_matching': sum(1 for a, b in compared_changed if a == b)
+    }
+
+    print(f"   Replayed {len(replayed)}, skipped {skipped} (images not captured or no image in request), "
+          f"{wall_seconds:.1f}s wall time")
+    print(f"   {'':>19} {'p50':>9} {'p90':>9} {'p95':>9} {'p99':>9}")
+    for label, values in report['latency_ms'].items():
+        print(f"   {label:>19} " + ' '.join(f"{values.get(q, 0):>9.1f}" for q in ('p50', 'p90', 'p95', 'p99')))
+    print(f"   Status mismatches: {status_mismatches}")
+    if compared:
+        print(f"   Outputs identical: {matching}/{len(compared)} ({matching / len(compared):.1%})")
+    if compared_changed:
+        print(f"   Outputs of changed URL images identical: "
+              f"{report['outputs_with_changed_images_matching']}/{len(compared_changed)}")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"📝 Report: {args.report}")
+
+
+if __name__ == '__main__':
+    main()
@@ -15,15 +15,23 @@ For GitHub Actions, set these secrets:
 - RUNPOD_API_KEY
 - DOCKER_USERNAME (optional)
 - DOCKER_PASSWORD (optional)
+
+Set RUNPOD_API_BASE to run against a local stand-in of the REST API; the SSH host
+and port are taken from the pod's publicIp/portMappings as returned by that API.
 """
 
 import requests
 import paramiko
+import random
+import socket
 import time
 import os
 import sys
 import tempfile
+from contextlib import contextmanager
 from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.backends import default_backend
@@ -35,7 +43,75 @@ CONTAINER_DISK_GB = 50  # Increased for Docker build
 # Try Docker-in-Docker enabled image
 DOCKER_IMAGE = "docker:dind"  # Docker-in-Docker official image
 POD_NAME = f"auto-build-{int(time.time())}"
-ESTIMATED_COST_PER_HOUR = 0.44  # RTX 4000 SECURE cloud cost
+ESTIMATED_COST_PER_HOUR = 0.44  # RTX 4000 SECURE cloud cost, used when the API reports no price
+RUNPOD_API_BASE = os.environ.get('RUNPOD_API_BASE', 'https://rest.runpod.io/v1').rstrip('/')
+
+# Readiness probing: exponential backoff with full jitter, capped per attempt
+BACKOFF_INITIAL_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+SSH_READY_TIMEOUT = 600
+BUILD_PHASES = ('create', 'ready', 'ssh', 'clone', 'build', 'push', 'teardown')
+
+class PhaseTimer:
+    """Wall-clock time per build phase, plus how long the pod existed"""
+
+    def __init__(self):
+        self.durations = {}
+        self.pod_created_at = None
+        self.pod_terminated_at = None
+
+    @contextmanager
+    def phase(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.durations[name] = self.durations.get(name, 0.0) + time.monotonic() - start
+
+    def billed_seconds(self):
+        """Seconds the pod was alive (until now if it was never terminated)"""
+        if self.pod_created_at is None:
+            return 0.0
+        return (self.pod_terminated_at or time.monotonic()) - self.pod_created_at
+
+    def report(self, cost_per_hour):
+        """Print the per-phase timings and the cost of the measured pod runtime"""
+        print("\n⏱️  Phase timings:")
+        for name in BUILD_PHASES:
+            if name in self.durations:
+                print(f"   {name:<10} {self.durations[name]:>8.1f}s")
+        print(f"   {'total':<10} {sum(self.durations.values()):>8.1f}s")
+        billed = self.billed_seconds()
+        cost = billed / 3600 * cost_per_hour
+        print(f"💰 Cost: ${cost:.3f} ({billed / 60:.1f} minutes of pod runtime @ ${cost_per_hour}/hr)")
+        return cost
+
+def backoff_delays(initial=BACKOFF_INITIAL_SECONDS, maximum=BACKOFF_MAX_SECONDS):
+    """Exponential backoff with full jitter: random delays in [0, min(maximum, initial * 2^n)]"""
+    attempt = 0
+    while True:
+        yield random.uniform(0, min(maximum, initial * 2 ** attempt))
+        attempt += 1
+
+def create_session(api_key):
+    """
+    Pooled HTTP session for the RunPod REST API
+
+    Keeps the TLS connection alive across status polls. Idempotent requests (GET,
+    DELETE) are retried on connection errors and 429/5xx; pod creation is not, so a
+    lost response cannot launch a second pod.
+    """
+    session = requests.Session()
+    session.headers.update({
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    })
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset({'GET', 'DELETE'}))
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
 
 def generate_ssh_keypair():
     """Generate a temporary SSH key pair"""
@@ -64,15 +140,11 @@ def generate_ssh_keypair():
     print("✅ SSH key pair generated")
     return private_key, public_key
 
-def create_pod(api_key, ssh_public_key):
+def create_pod(session, ssh_public_key):
     """Create a RunPod GPU pod using REST API with SSH key"""
     print("🚀 Creating RunPod pod with SSH access...")
     
-    url = "https://rest.runpod.io/v1/pods"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
+    url = f"{RUNPOD_API_BASE}/pods"
     
     # Add SSH public key to environment variables
     payload = {
@@ -91,7 +163,7 @@ def create_pod(api_key, ssh_public_key):
     }
     
     try:
-        response = requests.post(url, headers=headers, json=payload)
+        response = session.post(url, json=payload, timeout=60)
         response.raise_for_status()
         
         pod = response.json()
@@ -109,38 +181,32 @@ def create_pod(api_key, ssh_public_key):
             print(f"Response: {e.response.text}")
         sys.exit(1)
 
-def wait_for_pod(api_key, pod_id, timeout=900):
-    """Wait for pod to be running using REST API"""
+def wait_for_pod(session, pod_id, timeout=900):
+    """Wait for pod to be running using REST API, polling with exponential backoff"""
     print("⏳ Waiting for pod to be ready...")
     
-    url = f"https://rest.runpod.io/v1/pods/{pod_id}"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-    }
+    url = f"{RUNPOD_API_BASE}/pods/{pod_id}"
     
-    start_time = time.time()
-    check_count = 0
+    start_time = time.monotonic()
+    status = 'UNKNOWN'
+    public_ip = None
+    last_reported = None
+    delays = backoff_delays()
     
-    while time.time() - start_time < timeout:
+    while time.monotonic() - start_time < timeout:
         try:
-            response = requests.get(url, headers=headers)
+            response = session.get(url, timeout=30)
             response.raise_for_status()
             
             pod = response.json()
             status = pod.get('desiredStatus', 'UNKNOWN')
             public_ip = pod.get('publicIp')
-            runtime_status = pod.get('runtime', {})
             
-            check_count += 1
-            
-            # Show detailed info every 30 seconds (3 checks)
-            if check_count % 3 == 0:
-                elapsed = int(time.time() - start_time)
+            # Only print when something changed
+            if (status, public_ip) != last_reported:
+                elapsed = int(time.monotonic() - start_time)
                 print(f"   Status: {status}, Public IP: {public_ip or 'waiting...'} ({elapsed}s)")
-                if runtime_status:
-                    print(f"   Runtime: {runtime_status}")
-            else:
-                print(f"   Status: {status}...")
+                last_reported = (status, public_ip)
             
             # Check if pod is ready
             if status == 'RUNNING' and public_ip:
@@ -148,25 +214,50 @@ def wait_for_pod(api_key, pod_id, timeout=900):
                 print(f"🌐 Public IP: {public_ip}")
                 return pod
             
-            time.sleep(10)
-            
         except Exception as e:
             print(f"⚠️  Error checking status: {e}")
-            time.sleep(10)
+        
+        time.sleep(next(delays))
     
     print(f"❌ Pod failed to start within {timeout}s")
     print(f"   Last known status: {status}")
     print(f"   Last known public IP: {public_ip or 'None'}")
     return None
 
-def get_ssh_connection(pod, private_key_bytes):
+def wait_for_ssh_port(host, port, timeout=SSH_READY_TIMEOUT):
+    """
+    Probe the SSH port until sshd answers with its banner
+
+    A TCP connect alone is not enough: RunPod's proxy accepts connections before
+    sshd inside the container is up, so the probe waits for the "SSH-" banner.
+
+    Returns:
+        True once the port is serving SSH, False on timeout
+    """
+    start_time = time.monotonic()
+    delays = backoff_delays()
+    attempts = 0
+    while time.monotonic() - start_time < timeout:
+        attempts += 1
+        try:
+            with socket.create_connection((host, port), timeout=5) as sock:
+                sock.settimeout(5)
+                if sock.recv(4).startswith(b'SSH-'):
+                    print(f"✅ SSH port answering after {time.monotonic() - start_time:.1f}s ({attempts} probe(s))")
+                    return True
+        except OSError:
+            pass
+        time.sleep(next(delays))
+    return False
+
+def get_ssh_connection(pod, private_key_bytes, timeout=SSH_READY_TIMEOUT):
     """Get SSH connection to pod using private key"""
     print("🔌 Connecting via SSH...")
     
     try:
         # Extract connection info from REST API response
         ssh_host = pod.get('publicIp')
-        port_mappings = pod.get('portMappings', {})
+        port_mappings = pod.get('portMappings') or {}
         
         # Get the public port for SSH (port 22)
         ssh_port = port_mappings.get('22')
@@ -182,21 +273,24 @@ def get_ssh_connection(pod, private_key_bytes):
         
         print(f"📡 Connecting to {ssh_host}:{ssh_port}")
         
-        # Create SSH client
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        
         # Load the private key
         private_key = paramiko.RSAKey.from_private_key_file(private_key_bytes)
         
-        # Wait for SSH to be ready
-        print("⏳ Waiting for SSH to be ready (60 seconds)...")
-        time.sleep(60)
+        # Start as soon as sshd answers instead of sleeping a fixed minute
+        print("⏳ Waiting for SSH to be ready...")
+        start_time = time.monotonic()
+        if not wait_for_ssh_port(ssh_host, ssh_port, timeout):
+            print(f"❌ SSH port not reachable within {timeout}s")
+            return None
         
-        max_retries = 3
-        for attempt in range(max_retries):
+        # The key may be installed shortly after sshd starts, so auth failures are retried too
+        delays = backoff_delays()
+        attempt = 0
+        while True:
+            attempt += 1
+            ssh = paramiko.SSHClient()
+            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
             try:
-                print(f"🔄 Connection attempt {attempt + 1}/{max_retries}...")
                 ssh.connect(
                     hostname=ssh_host,
                     port=ssh_port,
@@ -206,29 +300,43 @@ def get_ssh_connection(pod, private_key_bytes):
                     look_for_keys=False,
                     allow_agent=False
                 )
-                print("✅ SSH connected!")
+                print(f"✅ SSH connected! (attempt {attempt})")
                 return ssh
                 
             except Exception as e:
-                if attempt < max_retries - 1:
-                    print(f"⚠️  Attempt {attempt + 1} failed: {e}")
-                    print(f"🔄 Retrying in 30 seconds...")
-                    time.sleep(30)
-                else:
+                ssh.close()
+                if time.monotonic() - start_time >= timeout:
                     raise
-        
-        return None
+                delay = next(delays)
+                print(f"⚠️  Attempt {attempt} failed: {e}, retrying in {delay:.1f}s")
+                time.sleep(delay)
         
     except Exception as e:
         print(f"❌ SSH connection failed: {e}")
         print("💡 Try using RunPod web terminal or SSH manually")
         return None
 
-def execute_build(ssh, github_repo, github_sha, registry, registry_user, registry_token):
-    """Execute build commands on pod"""
+def run_remote(ssh, script):
+    """Run a shell script on the pod, streaming its output, and return the exit code"""
+    stdin, stdout, stderr = ssh.exec_command(script, get_pty=True)
+    
+    # Stream output in real-time
+    for line in stdout:
+        print(line.strip())
+    
+    exit_code = stdout.channel.recv_exit_status()
+    if exit_code != 0:
+        for line in stderr:
+            print(line.strip())
+    return exit_code
+
+def execute_build(ssh, github_repo, github_sha, registry, registry_user, registry_token, timer):
+    """Execute build commands on pod, one remote script (and timed phase) per step"""
     print("🔨 Starting Docker build...")
     
-    build_commands = f"""
+    repo_dir = "/root/build-temp/repo"
+    phases = [
+        ('clone', f"""
 set -e
 
 echo "📥 Installing git..."
@@ -255,6 +363,10 @@ echo "📦 Cloning repository..."
 git clone https://github.com/{github_repo}.git repo
 cd repo
 git checkout {github_sha}
+"""),
+        ('build', f"""
+set -e
+cd {repo_dir}
 
 echo "🔨 Building Docker image..."
 docker build -f Dockerfile.deepseek.prebuilt -t temp-build:latest .
@@ -262,6 +374,9 @@ docker build -f Dockerfile.deepseek.prebuilt -t temp-build:latest .
 echo "🏷️  Tagging images..."
 docker tag temp-build:latest {registry}/{github_repo}/deepseek-ocr:latest
 docker tag temp-build:latest {registry}/{github_repo}/deepseek-ocr:{github_sha[:8]}
+"""),
+        ('push', f"""
+set -e
 
 echo "🔐 Logging in to container registry..."
 echo "{registry_token}" | docker login {registry} -u {registry_user} --password-stdin
@@ -273,55 +388,51 @@ docker push {registry}/{github_repo}/deepseek-ocr:{github_sha[:8]}
 echo "✅ Build complete!"
 echo "📊 Image size:"
 docker images {registry}/{github_repo}/deepseek-ocr:latest --format "table {{{{.Repository}}}}\\t{{{{.Tag}}}}\\t{{{{.Size}}}}"
-"""
+"""),
+    ]
     
     try:
-        # Execute commands
-        stdin, stdout, stderr = ssh.exec_command(build_commands, get_pty=True)
-        
-        # Stream output in real-time
-        for line in stdout:
-            print(line.strip())
+        for name, script in phases:
+            with timer.phase(name):
+                exit_code = run_remote(ssh, script)
+            if exit_code != 0:
+                print(f"❌ Build failed in {name} step with exit code {exit_code}")
+                return False
         
-        # Check for errors
-        exit_code = stdout.channel.recv_exit_status()
-        
-        if exit_code == 0:
-            print("✅ Build succeeded!")
-            return True
-        else:
-            print(f"❌ Build failed with exit code {exit_code}")
-            for line in stderr:
-                print(line.strip())
-            return False
+        print("✅ Build succeeded!")
+        return True
             
     except Exception as e:
         print(f"❌ Build execution failed: {e}")
         return False
 
-def terminate_pod(api_key, pod_id):
-    """Terminate the RunPod pod using REST API"""
+def terminate_pod(session, pod_id):
+    """
+    Terminate the RunPod pod using REST API
+
+    Returns:
+        True when the pod was stopped and deleted
+    """
     print(f"🧹 Terminating pod {pod_id}...")
     
-    url = f"https://rest.runpod.io/v1/pods/{pod_id}/stop"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-    }
+    url = f"{RUNPOD_API_BASE}/pods/{pod_id}/stop"
     
     try:
-        response = requests.post(url, headers=headers)
+        response = session.post(url, timeout=60)
         response.raise_for_status()
         print("✅ Pod stopped successfully")
         
         # Also delete the pod
-        delete_url = f"https://rest.runpod.io/v1/pods/{pod_id}"
-        response = requests.delete(delete_url, headers=headers)
+        delete_url = f"{RUNPOD_API_BASE}/pods/{pod_id}"
+        response = session.delete(delete_url, timeout=60)
         response.raise_for_status()
         print("✅ Pod deleted")
+        return True
         
     except Exception as e:
         print(f"⚠️  Failed to terminate pod: {e}")
         print(f"💡 Manually terminate at: https://www.runpod.io/console/pods/{pod_id}")
+        return False
 
 def main():
     """Main automation flow"""
@@ -350,6 +461,9 @@ def main():
     ssh = None
     success = False
     private_key_file = None
+    session = create_session(api_key)
+    timer = PhaseTimer()
+    cost_per_hour = ESTIMATED_COST_PER_HOUR
     
     try:
         # Step 1: Generate SSH key pair
@@ -364,16 +478,25 @@ def main():
         os.chmod(private_key_file, 0o600)
         
         # Step 2: Create pod with public key
-        pod_id, initial_pod = create_pod(api_key, public_key_bytes)
+        with timer.phase('create'):
+            pod_id, initial_pod = create_pod(session, public_key_bytes)
+        # Billing starts once the pod exists
+        timer.pod_created_at = time.monotonic()
+        try:
+            cost_per_hour = float(initial_pod.get('costPerHr') or ESTIMATED_COST_PER_HOUR)
+        except (TypeError, ValueError):
+            pass
         
         # Step 3: Wait for pod to be ready
-        pod = wait_for_pod(api_key, pod_id)
+        with timer.phase('ready'):
+            pod = wait_for_pod(session, pod_id)
         if not pod:
             print("❌ Pod failed to start")
             sys.exit(1)
         
         # Step 4: Connect via SSH with private key
-        ssh = get_ssh_connection(pod, private_key_file)
+        with timer.phase('ssh'):
+            ssh = get_ssh_connection(pod, private_key_file)
         if not ssh:
             print("\n" + "="*70)
             print("❌ SSH automation failed - Manual build required")
@@ -396,19 +519,14 @@ def main():
             print(f"   docker push {registry}/{github_repo}/deepseek-ocr:latest")
             print("")
             print("⚠️  POD LEFT RUNNING - You must stop it manually when done!")
-            print("💰 Costing: ~$0.26/hour while running")
+            print(f"💰 Costing: ~${cost_per_hour}/hour while running")
             print("="*70)
             
             # Don't terminate - let user build manually
             return  # Exit without error so GitHub Actions doesn't fail
         
         # Step 4: Execute build
-        success = execute_build(ssh, github_repo, github_sha, registry, registry_user, registry_token)
-        
-        # Calculate cost
-        runtime_minutes = 5  # Estimated
-        cost = runtime_minutes * (ESTIMATED_COST_PER_HOUR / 60)
-        print(f"\n💰 Estimated cost: ${cost:.3f} ({runtime_minutes} minutes @ ${ESTIMATED_COST_PER_HOUR}/hr)")
+        success = execute_build(ssh, github_repo, github_sha, registry, registry_user, registry_token, timer)
         
     except KeyboardInterrupt:
         print("\n⚠️  Build interrupted by user")
@@ -432,7 +550,13 @@ def main():
                 pass
         
         if pod_id:
-            terminate_pod(api_key, pod_id)
+            with timer.phase('teardown'):
+                if terminate_pod(session, pod_id):
+                    timer.pod_terminated_at = time.monotonic()
+        
+        # Cost from the measured pod lifetime (until now if termination failed)
+        timer.report(cost_per_hour)
+        session.close()
     
     # Exit with appropriate code
     # If we got here without success and pod_id exists, it means manual build is needed
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for checking runpod_build_automation.py without RunPod
+Serves a fake RunPod REST API (/pods, /pods/{id}, /pods/{id}/stop) and a paramiko
+SSH server that comes up some seconds after the pod is created, like sshd inside a
+freshly started container. Then runs the automation's main() against them and checks:
+
+- the build starts soon after sshd is up (no fixed sleep before connecting)
+- all phases (create, ready, ssh, clone, build, push, teardown) are timed
+- the reported cost matches the pod lifetime measured by the fake API
+
+Usage:
+    pip install -r requirements.txt
+    python3 runpod_standin.py
+    python3 runpod_standin.py --pod-delay 3 --ssh-delay 10
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import paramiko
+
+POD_ID = 'standin-pod'
+COST_PER_HOUR = 0.69
+
+
+class FakeRunPod:
+    """Pod lifecycle seen by the fake API and SSH server, in time.monotonic() seconds"""
+
+    def __init__(self, pod_delay, ssh_delay):
+        self.pod_delay = pod_delay
+        self.ssh_delay = ssh_delay
+        self.ssh_port = None
+        self.created_at = None
+        self.deleted_at = None
+        self.sshd_up_at = None
+        self.first_exec_at = None
+        self.commands = []
+        self.lock = threading.Lock()
+
+
+def make_api_handler(state):
+    """HTTP handler class implementing the pod endpoints used by the automation"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, body, code=200):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if self.path == '/v1/pods':
+                state.created_at = time.monotonic()
+                threading.Thread(target=serve_ssh, args=(state,), daemon=True).start()
+                self._send({'id': POD_ID, 'costPerHr': COST_PER_HOUR})
+            elif self.path == f'/v1/pods/{POD_ID}/stop':
+                self._send({})
+            else:
+                self._send({'error': 'not found'}, 404)
+
+        def do_GET(self):
+            if self.path != f'/v1/pods/{POD_ID}':
+                self._send({'error': 'not found'}, 404)
+                return
+            running = time.monotonic() - state.created_at >= state.pod_delay
+            self._send({
+                'id': POD_ID,
+                'desiredStatus': 'RUNNING' if running else 'CREATED',
+                'publicIp': '127.0.0.1' if running else None,
+                'portMappings': {'22': state.ssh_port}
+            })
+
+        def do_DELETE(self):
+            if self.path != f'/v1/pods/{POD_ID}':
+                self._send({'error': 'not found'}, 404)
+                return
+            state.deleted_at = time.monotonic()
+            self._send({})
+
+    return Handler
+
+
+class StandinSSHServer(paramiko.ServerInterface):
+    """Accepts any public key and answers every command with an echo and exit status 0"""
+
+    def __init__(self, state):
+        self.state = state
+
+    def get_allowed_auths(self, username):
+        return 'publickey'
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        with self.state.lock:
+            if self.state.first_exec_at is None:
+                self.state.first_exec_at = time.monotonic()
+            self.state.commands.append(command.decode(errors='replace'))
+
+        def run():
+            # Let paramiko acknowledge the exec request before the channel is closed
+            time.sleep(0.2)
+            last_line = command.decode(errors='replace').strip().splitlines()[-1]
+            channel.sendall(f'standin ran: {last_line}\n'.encode())
+            channel.send_exit_status(0)
+            channel.close()
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+
+def serve_ssh(state):
+    """Listen on the pod's SSH port once ssh_delay seconds have passed since creation"""
+    host_key = paramiko.RSAKey.generate(2048)
+    time.sleep(state.ssh_delay)
+    listener = socket.create_server(('127.0.0.1', state.ssh_port))
+    state.sshd_up_at = time.monotonic()
+    print(f"🧪 Stand-in sshd up {state.sshd_up_at - state.created_at:.1f}s after pod creation")
+    while True:
+        connection, _ = listener.accept()
+
+        def serve(connection=connection):
+            # Readiness probes hang up after the banner, which the transport reports as an error
+            try:
+                transport = paramiko.Transport(connection)
+                transport.add_server_key(host_key)
+                transport.start_server(server=StandinSSHServer(state))
+            except Exception:
+                connection.close()
+
+        threading.Thread(target=serve, daemon=True).start()
+
+
+def free_port():
+    """A local TCP port that nothing listens on yet"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pod-delay', type=float, default=2.0, help='Seconds until the pod reports RUNNING')
+    parser.add_argument('--ssh-delay', type=float, default=6.0, help='Seconds until sshd listens')
+    parser.add_argument('--max-start-gap', type=float, default=None,
+                        help='Allowed seconds between sshd up and the first build command '
+                             '(default: the automation\'s backoff cap plus 2s)')
+    args = parser.parse_args()
+
+    # Readiness probes hang up mid-handshake; paramiko would log a traceback for each
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    state = FakeRunPod(args.pod_delay, args.ssh_delay)
+    state.ssh_port = free_port()
+    api = ThreadingHTTPServer(('127.0.0.1', 0), make_api_handler(state))
+    threading.Thread(target=api.serve_forever, daemon=True).start()
+
+    # The automation reads its API base at import time
+    os.environ['RUNPOD_API_BASE'] = f'http://127.0.0.1:{api.server_port}/v1'
+    os.environ.setdefault('RUNPOD_API_KEY', 'standin')
+    os.environ.setdefault('REGISTRY_TOKEN', 'standin')
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    import runpod_build_automation as automation
+
+    timers = []
+    costs = []
+
+    class RecordingTimer(automation.PhaseTimer):
+        def __init__(self):
+            super().__init__()
+            timers.append(self)
+
+        def report(self, cost_per_hour):
+            cost = super().report(cost_per_hour)
+            costs.append((cost, cost_per_hour))
+            return cost
+
+    automation.PhaseTimer = RecordingTimer
+    try:
+        automation.main()
+        exit_code = 0
+    except SystemExit as e:
+        exit_code = e.code
+    finally:
+        api.shutdown()
+
+    timer = timers[0]
+    cost, cost_per_hour = costs[0]
+    max_start_gap = args.max_start_gap
+    if max_start_gap is None:
+        max_start_gap = automation.BACKOFF_MAX_SECONDS + 2
+    checks = []
+    checks.append(('automation exited with 0', exit_code == 0, f'exit code {exit_code}'))
+
+    if state.sshd_up_at is not None and state.first_exec_at is not None:
+        gap = state.first_exec_at - state.sshd_up_at
+        checks.append((f'build started within {max_start_gap:.1f}s of sshd', 0 <= gap <= max_start_gap,
+                       f'{gap:.2f}s'))
+    else:
+        checks.append(('build started', False, 'no command reached the stand-in sshd'))
+
+    missing = [name for name in automation.BUILD_PHASES if name not in timer.durations]
+    checks.append(('all phases timed', not missing, f'missing {missing}' if missing else
+                   ', '.join(f'{name} {timer.durations[name]:.1f}s' for name in automation.BUILD_PHASES)))
+
+    if state.deleted_at is not None:
+        lifetime = state.deleted_at - state.created_at
+        expected = lifetime / 3600 * COST_PER_HOUR
+        checks.append(('cost matches pod lifetime',
+                       cost_per_hour == COST_PER_HOUR and abs(timer.billed_seconds() - lifetime) < 1.0,
+                       f'${cost:.5f} for {timer.billed_seconds():.1f}s billed vs ${expected:.5f} '
+                       f'for {lifetime:.1f}s measured @ ${cost_per_hour}/hr'))
+    else:
+        checks.append(('pod deleted', False, 'DELETE never reached the stand-in API'))
+
+    print("\n🧪 Stand-in checks:")
+    for name, passed, detail in checks:
+        print(f"   {'✅' if passed else '❌'} {name}: {detail}")
+    sys.exit(0 if all(passed for _, passed, _ in checks) else 1)
+
+
+if __name__ == '__main__':
+    main()
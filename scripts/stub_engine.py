@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Stub inference engine and synthetic receipts for DeepSeek-OCR benchmarks
+Injected into the server with DEEPSEEK_OCR_ENGINE=stub_engine:create_engine (this
+directory must be importable), so no GPU or model weights are needed.
+
+Usage:
+    PYTHONPATH=scripts DEEPSEEK_OCR_ENGINE=stub_engine:create_engine python3 deepseek_ocr_server.py
+"""
+
+import json
+import math
+import os
+import time
+
+from PIL import Image
+
+
+def create_engine(model_path=None):
+    """
+    Engine factory called by deepseek_ocr_server.create_engine()
+
+    Args:
+        model_path: Snapshot directory whose files are read to simulate weight loading, or None
+
+    Returns:
+        StubLLM instance
+    """
+    return StubLLM(load_seconds=float(os.environ.get('DEEPSEEK_OCR_STUB_LOAD_SECONDS', '0')),
+                   weights_path=model_path)
+
+
+class StubLLM:
+    """
+    Deterministic stand-in for vllm.LLM used for benchmarks and local development
+
+    Reads the synthetic receipts drawn by make_synthetic_receipt(): every line item is a
+    dark horizontal band whose grey levels encode the item index. Images are downscaled
+    to the model input size first, so bands that shrink below min_band_px become
+    illegible in the same way small print does on the real model.
+
+    Token log-probabilities follow legibility: bands just above min_band_px decode with
+    low confidence. Pass confidences to return canned per-output confidences instead.
+    """
+
+    LEVEL_BASE = 16
+    LEVEL_STEP = 8
+    LEVEL_COUNT = 24
+
+    def __init__(self, input_size=1024, min_band_px=8, batch_overhead=0.01,
+                 latency_per_vision_token=0.00002, latency_per_output_char=0.00002,
+                 confidences=None, load_seconds=0.0, weights_path=None):
+        # Simulates weight loading: a fixed delay and/or a serial read of the snapshot's files
+        time.sleep(load_seconds)
+        if weights_path and os.path.isdir(weights_path):
+            for root, _, names in os.walk(weights_path):
+                for name in sorted(names):
+                    with open(os.path.join(root, name), 'rb') as f:
+                        while f.read(1024 * 1024):
+                            pass
+        self.input_size = input_size
+        self.min_band_px = min_band_px
+        self.batch_overhead = batch_overhead
+        self.latency_per_vision_token = latency_per_vision_token
+        self.latency_per_output_char = latency_per_output_char
+        self.confidences = list(confidences) if confidences else None
+        self._calls = 0
+
+    def _resize(self, image):
+        scale = min(1.0, self.input_size / max(image.size))
+        if scale == 1.0:
+            return image.convert('L')
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        return image.convert('L').resize(size, Image.BOX)
+
+    def _decode_level(self, value):
+        return min(self.LEVEL_COUNT - 1, max(0, round((value - self.LEVEL_BASE) / self.LEVEL_STEP)))
+
+    def _read_items(self, image):
+        width, height = image.size
+        pixels = image.load()
+        # A row belongs to a band when its centre pixel is clearly darker than the paper
+        dark_rows = [pixels[width // 2, y] < 235 for y in range(height)]
+        items = []
+        confidences = []
+        y = 0
+        while y < height:
+            if not dark_rows[y]:
+                y += 1
+                continue
+            start = y
+            while y < height and dark_rows[y]:
+                y += 1
+            if y - start < self.min_band_px:
+                continue
+            confidences.append(min(0.99, 0.6 + 0.4 * (y - start - self.min_band_px) / self.min_band_px))
+            row = (start + y) // 2
+            high = self._decode_level(pixels[width // 4, row])
+            low = self._decode_level(pixels[3 * width // 4, row])
+            index = high * self.LEVEL_COUNT + low
+            items.append({
+                'item': f'item-{index}',
+                'quantity': 1,
+                'unit_price': f'{index + 1}.00',
+                'total_price': f'{index + 1}.00'
+            })
+        confidence = sum(confidences) / len(confidences) if confidences else 0.3
+        return items, confidence
+
+    def generate(self, model_inputs, sampling_params=None):
+        from types import SimpleNamespace
+
+        outputs = []
+        vision_tokens = 0
+        longest_output = 0
+        for model_input in model_inputs:
+            image = self._resize(model_input['multi_modal_data']['image'])
+            vision_tokens += -(-image.width // 16) * -(-image.height // 16)
+            items, confidence = self._read_items(image)
+            if self.confidences:
+                confidence = self.confidences[self._calls % len(self.confidences)]
+            self._calls += 1
+            text = json.dumps(items)
+            longest_output = max(longest_output, len(text))
+            token_ids = list(range(max(1, len(text) // 4)))
+            outputs.append(SimpleNamespace(outputs=[SimpleNamespace(
+                text=text,
+                token_ids=token_ids,
+                cumulative_logprob=len(token_ids) * math.log(max(confidence, 1e-6))
+            )]))
+
+        # Prefill scales with the total vision tokens, decode runs in parallel across the batch
+        time.sleep(self.batch_overhead
+                   + vision_tokens * self.latency_per_vision_token
+                   + longest_output * self.latency_per_output_char)
+        return outputs
+
+
+
+def make_synthetic_receipt(num_items, width=600, band_height=24, gap=16, repeat=1):
+    """
+    Draw a synthetic receipt readable by StubLLM
+
+    Args:
+        num_items: Number of distinct line items to draw
+        width: Image width in pixels
+        band_height: Height of each line item band in pixels
+        gap: Blank space between bands in pixels
+        repeat: How many times each line item appears in a row (the same product
+            bought several times), so identical lines can straddle tile overlaps
+
+    Returns:
+        Tuple of (PIL Image, list of expected item names in receipt order)
+    """
+    from PIL import ImageDraw
+
+    indices = [index for index in range(num_items) for _ in range(repeat)]
+    height = gap + len(indices) * (band_height + gap)
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    for position, index in enumerate(indices):
+        top = gap + position * (band_height + gap)
+        high, low = divmod(index, StubLLM.LEVEL_COUNT)
+        high_level = StubLLM.LEVEL_BASE + high * StubLLM.LEVEL_STEP
+        low_level = StubLLM.LEVEL_BASE + low * StubLLM.LEVEL_STEP
+        draw.rectangle([0, top, width // 2 - 1, top + band_height - 1], fill=(high_level,) * 3)
+        draw.rectangle([width // 2, top, width - 1, top + band_height - 1], fill=(low_level,) * 3)
+    return image, [f'item-{index}' for index in indices]